@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
-import time, importlib, inspect, os, json
+import time, os, json, asyncio
+from concurrent.futures import Future
 from typing import Any, Optional, Dict
-from python.helpers import extract_tools, rate_limiter, files, errors
+from python.helpers import extract_tools, rate_limiter, files, errors, tokens, asyncio_utils, messages, context_window, prompt_cache, memory_query
 from python.helpers.print_style import PrintStyle
 from langchain.schema import AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
@@ -16,30 +17,66 @@ class AgentConfig:
     chat_model: BaseChatModel | BaseLLM
     utility_model: BaseChatModel | BaseLLM
     embeddings_model:Embeddings
-    memory_subdir: str = ""
+    memory_subdir: str = "" # separate memory database per subdir, e.g. per user or tenant
+    memory_max_open_dbs: int = 8 # memory databases kept open at once, least recently used are closed
+    memory_backend: str = "chroma" # vector index for memories: chroma, numpy (in-process flat index) or hnsw (requires hnswlib)
     auto_memory_count: int = 3
     auto_memory_skip: int = 2
+    auto_memory_strategy: str = memory_query.LAST_TURNS # how memories are queried: full, last_turns, key_phrases or multi
+    auto_memory_turns: int = 4 # messages the last_turns, key_phrases and multi strategies look at
+    auto_memory_threshold: float = 0.3 # minimum relevance score of memories to inject, nothing is injected if none passes
+    auto_memory_cleanup: str = "llm" # filter retrieved memories with the utility model ("llm"), key term overlap ("extractive") or not at all ("none")
+    memory_ingest_batch_size: int = 64
+    memory_ingest_workers: int = 4 # concurrent embedding requests during bulk ingest
+    memory_ingest_chunk_size: int = 2000 # characters per memory when ingesting files
+    memory_dedupe_threshold: float = 0.95 # saving a memory this similar to a stored one updates it instead, 0 disables
+    memory_compact_threshold: float = 0.9 # default similarity at which compaction merges memories
     rate_limit_seconds: int = 60
     rate_limit_requests: int = 15
     rate_limit_input_tokens: int = 1000000
     rate_limit_output_tokens: int = 0
+    rate_limit_shared_dir: str = "" # directory for rate limiter state shared across processes, empty = shared within this process only
+    tokenizer: str = "cl100k_base" # tiktoken encoding, "approximate" or a name registered in tokens.register_counter
     msgs_keep_max: int = 25
     msgs_keep_start: int = 5
     msgs_keep_end: int = 10
+    context_budget_tokens: int = 0 # token budget for history, replaces the msgs_keep_* message counts when set
+    context_keep_start_ratio: float = 0.2
+    context_keep_end_ratio: float = 0.5
+    context_max_message_ratio: float = 0.25 # older messages larger than this share of the budget get truncated
+    msgs_cleanup_background: bool = True # summarize in a background worker, the loop continues with raw history meanwhile
+    msgs_cleanup_incremental: bool = False # merge newly evicted messages into a rolling summary instead of re-summarizing the middle
     response_timeout_seconds: int = 60
     max_tool_response_length: int = 3000
+    stream_tool_parsing: bool = True
+    tool_hot_reload: bool = False # reload tool modules from python/tools when their files change
+    prompt_stable_prefix: bool = False # keep system prompt and history byte-stable for provider prompt caching, memories go after them
+    subordinate_pool_size: int = 4 # finished subordinates kept per delegation depth and reused for new tasks, 0 disables
+    subordinate_max_parallel: int = 4 # subordinates running at once when call_subordinate gets a list of messages
+    code_exec_backend: str = "docker" # where code runs: docker, local (shell on this host, not sandboxed) or ssh (requires paramiko)
     code_exec_docker_enabled: bool = True
     code_exec_docker_name: str = "agent-zero-exe"
     code_exec_docker_image: str = " frdel/agent-zero-exe:latest"
     code_exec_docker_ports: dict[str,int] = field(default_factory=lambda: {"8022/tcp": 8022})
     code_exec_docker_volumes: dict[str, dict[str, str]] = field(default_factory=lambda: {files.get_abs_path("work_dir"): {"bind": "/root", "mode": "rw"}})
+    code_exec_ssh_addr: str = "localhost"
+    code_exec_ssh_port: int = 8022
+    code_exec_ssh_user: str = "root"
+    code_exec_ssh_pass: str = "toor"
+    code_exec_docker_pool_size: int = 0 # pre-started containers leased one per agent and recycled after, 0 shares a single container
+    code_exec_timeout_seconds: int = 180 # code is killed after this many seconds, 0 for no limit
+    code_exec_max_output_bytes: int = 100_000 # output kept in memory per call, the start and the end of longer output are kept
+    code_exec_persistent_sessions: bool = True # python code runs in a long-lived interpreter, state is kept between calls
+    code_exec_session_pool_size: int = 1 # started sessions kept ready per runtime
+    code_exec_session_preload: dict[str, str] = field(default_factory=lambda: {"python": "try:\n    import numpy, pandas\nexcept ImportError:\n    pass"}) # code run when a session starts
     additional: Dict[str, Any] = field(default_factory=dict)
     
 
 class Agent:
 
     paused=False
-    streaming_agent=None
+    streaming_agents: set["Agent"] = set() # agents inside their message loop, parallel subordinates run at the same time
+    warm_data = ("cot_state",) # data kept by reset, the code execution sandbox stays started, released by close
     
     def __init__(self, number:int, config: AgentConfig):
 
@@ -52,7 +89,7 @@ class Agent:
         - config (AgentConfig): Configuration for this agent.
 
         Sets up the agent with the given configuration, reads the system and tools prompts,
-        and sets up a rate limiter.
+        and attaches the rate limiters shared by all agents using the same models.
 
         The agent is initialized with an empty history, and the current directory is changed
         to the work_dir directory.
@@ -65,59 +102,130 @@ class Agent:
 
         self.system_prompt = files.read_file("./prompts/agent.system.md", agent_name=self.agent_name)
         self.tools_prompt = files.read_file("./prompts/agent.tools.md")
+        self.rate_limiter = self.get_rate_limiter(self.config.chat_model)
+        self.utility_rate_limiter = self.get_rate_limiter(self.config.utility_model)
+        self.data = {} # free data object all the tools can use
+        self.loop: asyncio.AbstractEventLoop | None = None # event loop of the message loop, background tasks run on it
+        self.reset()
+
+        work_dir = files.get_abs_path("./work_dir")
+        if os.getcwd() != work_dir: os.chdir(work_dir) #change CWD to work_dir
 
+    def reset(self):
+        """
+        Clear the conversation so the agent can take a new task, used to reuse pooled subordinates.
+        Prompts, rate limiters and tool data listed in warm_data are kept, the data is reset to a clean state.
+        """
+        previous_cleanup = getattr(self, "cleanup_task", None)
+        if previous_cleanup: previous_cleanup.cancel() # the previous task's history is not summarized anymore
         self.history = []
+        self.history_summary: HumanMessage | None = None # rolling summary message, see msgs_cleanup_incremental
+        self.cleanup_task: asyncio.Future | Future | None = None
+        self.cleanup_task_messages: list = []
+        self.context_plan: context_window.ContextPlan | None = None # last token budget decisions, for inspection
+        self.memories = "" # last injected memories
+        self.memory_cleanup_cache: dict[tuple, str] = {} # (memory ids, history hash) -> cleaned memories
+        self.memory_retriever = memory_query.MemoryRetriever(
+            self.search_memories,
+            strategy=self.config.auto_memory_strategy,
+            turns=self.config.auto_memory_turns,
+            count=self.config.auto_memory_count)
+        self.token_counts = tokens.MessageTokenCounts(self.config.tokenizer) # memoized history message counts
+        self.prompt_cache_stats = prompt_cache.PromptCacheStats(tokenizer=self.config.tokenizer, token_counts=self.token_counts)
         self.last_message = ""
         self.intervention_message = ""
         self.intervention_status = False
-        self.rate_limiter = rate_limiter.RateLimiter(max_calls=self.config.rate_limit_requests,max_input_tokens=self.config.rate_limit_input_tokens,max_output_tokens=self.config.rate_limit_output_tokens,window_seconds=self.config.rate_limit_seconds)
-        self.data = {} # free data object all the tools can use
+        self.memory_skip_counter = 0
+        self.data = {field: value for field, value in self.data.items() if field in Agent.warm_data}
+        for value in self.data.values(): value.reset()
 
-        os.chdir(files.get_abs_path("./work_dir")) #change CWD to work_dir
+    def close(self):
+        """
+        Release what the agent keeps between tasks, like its code execution container and sessions.
+        Called when a subordinate is not pooled for reuse, the agent is not used after this.
+        """
+        warm = [self.data.pop(field) for field in Agent.warm_data if self.data.get(field)]
+        self.reset()
+        for value in warm: value.close()
         
 
+    def get_rate_limiter(self, model) -> rate_limiter.RateLimiter:
+        # all agents using the same model share one budget
+        return rate_limiter.get_rate_limiter(
+            rate_limiter.model_key(model),
+            max_calls=self.config.rate_limit_requests,
+            max_input_tokens=self.config.rate_limit_input_tokens,
+            max_output_tokens=self.config.rate_limit_output_tokens,
+            window_seconds=self.config.rate_limit_seconds,
+            shared_dir=self.config.rate_limit_shared_dir)
+
     def message_loop(self, msg: str):
+        return asyncio_utils.run_sync(self.amessage_loop(msg))
+
+    async def amessage_loop(self, msg: str):
         try:
             printer = PrintStyle(italic=True, font_color="#b3ffd9", padding=False)    
+            self.loop = asyncio.get_running_loop()
+            Agent.streaming_agents.add(self)
             user_message = files.read_file("./prompts/fw.user_message.md", message=msg)
             self.append_message(user_message, human=True)
-            memories = self.fetch_memories(True)
+            self.memories = await self.afetch_memories(True) or ""
             
             response = ""
             while True:
-                Agent.streaming_agent = self
                 agent_response = ""
+                self.apply_history_cleanup() # swap in history summary if finished in background
+                self.token_counts.prune(self.history) # counts of summarized or truncated messages are not needed anymore
                 self.intervention_status = False
 
                 try:
                     system = self.system_prompt + "\n\n" + self.tools_prompt
-                    memories = self.fetch_memories()
-                    if memories: system += "\n\n" + memories
+                    memories = await self.afetch_memories()
+                    if memories is not None: self.memories = memories # None means memory fetch was skipped this iteration
+                    prompt_messages = self.history
+
+                    if self.config.prompt_stable_prefix:
+                        # volatile memories go after the cacheable prefix and persist between memory fetches
+                        if self.memories:
+                            memories_msg = files.read_file("./prompts/fw.memories_injection.md", memories=self.memories)
+                            prompt_messages = self.inject_after_history(memories_msg)
+                    elif memories: system += "\n\n" + memories
 
                     prompt = ChatPromptTemplate.from_messages([
                         SystemMessage(content=system),
                         MessagesPlaceholder(variable_name="messages")
                     ])
                     
-                    inputs = {"messages": self.history}
+                    inputs = {"messages": prompt_messages}
                     chain = prompt | self.config.chat_model
 
-                    formatted_inputs = prompt.format(messages=self.history)
-                    tokens = int(len(formatted_inputs)/4)     
-                    self.rate_limiter.limit_call_and_input(tokens)
+                    prompt_tokens = self.count_prompt_tokens(system, prompt_messages)
+                    self.prompt_cache_stats.record_prompt(system, self.history, prompt_tokens)
+                    call_record = await self.rate_limiter.alimit_call_and_input(prompt_tokens)
                     
                     st.session_state.logs.append(f"{self.agent_name}: Starting a message:")
+
+                    tool_parser = extract_tools.StreamingToolParser() if self.config.stream_tool_parsing else None
+                    tool_request = None
                     
-                    for chunk in chain.stream(inputs):
-                        if isinstance(chunk, str): content = chunk
-                        elif hasattr(chunk, "content"): content = str(chunk.content)
-                        else: content = str(chunk)
-                        
-                        if content:
-                            agent_response += content
-                            st.session_state.logs.append(content)
-
-                    self.rate_limiter.set_output_tokens(int(len(agent_response)/4))
+                    stream = chain.astream(inputs)
+                    try:
+                        async for chunk in stream:
+                            self.prompt_cache_stats.record_usage(chunk)
+                            content = self._chunk_content(chunk)
+                            
+                            if content:
+                                agent_response += content
+                                st.session_state.logs.append(content)
+                                if tool_parser: tool_request = tool_parser.feed(content)
+                                if tool_request is not None: break # tool request is complete, dispatch without waiting for trailing text
+                    finally:
+                        await stream.aclose() # type: ignore # stop the generation when leaving early
+
+                    if tool_request is not None: agent_response = tool_parser.completed_text # type: ignore
+                    PrintStyle(font_color="gray", log_only=True).print(f"{self.agent_name}: {self.prompt_cache_stats}")
+
+                    self.rate_limiter.set_output_tokens(self.count_tokens(agent_response), call_record)
                     
                     if not self.intervention_status:
                         if self.last_message == agent_response:
@@ -127,7 +235,7 @@ class Agent:
                             st.session_state.logs.append(warning_msg)
                         else:
                             self.append_message(agent_response)
-                            tools_result = self.process_tools(agent_response)
+                            tools_result = await self.aprocess_tools(agent_response, tool_request)
                             if tools_result:
                                 response = tools_result
                                 break
@@ -141,7 +249,14 @@ class Agent:
             return response
 
         finally:
-            Agent.streaming_agent = None
+            Agent.streaming_agents.discard(self)
+
+    @staticmethod
+    def working_agents() -> list["Agent"]:
+        # streaming agents not waiting for a subordinate, the ones a user intervention is meant for
+        agents = list(Agent.streaming_agents)
+        waiting = {id(agent.get_data("superior")) for agent in agents}
+        return [agent for agent in agents if id(agent) not in waiting]
 
     def get_data(self, field:str):
         
@@ -183,61 +298,118 @@ class Agent:
         else:
             new_message = HumanMessage(content=msg) if human else AIMessage(content=msg)
             self.history.append(new_message)
-            self.cleanup_history(self.config.msgs_keep_max, self.config.msgs_keep_start, self.config.msgs_keep_end)
+            if self.config.context_budget_tokens > 0: self.cleanup_history_by_tokens()
+            else: self.cleanup_history(self.config.msgs_keep_max, self.config.msgs_keep_start, self.config.msgs_keep_end)
         if message_type=="ai":
             self.last_message = msg
 
-    def concat_messages(self,messages):
-        return "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
+    def count_tokens(self, text: str) -> int:
+        return tokens.get_counter(self.config.tokenizer)(text)
+
+    def count_prompt_tokens(self, system: str, messages: list) -> int:
+        # system prompt count is cached by content, message counts are memoized per agent
+        return self.count_tokens(system) + tokens.MESSAGE_OVERHEAD + self.token_counts.count_all(messages)
+
+    def inject_after_history(self, content: str) -> list:
+        # appended to the last human turn, a copy so history stays unchanged, two human turns in a row are rejected by some providers
+        last = self.history[-1] if self.history else None
+        if isinstance(last, HumanMessage):
+            return self.history[:-1] + [HumanMessage(content=f"{last.content}\n\n{content}")]
+        return self.history + [HumanMessage(content=content)]
+
+    def concat_messages(self,msgs):
+        return messages.concat_messages(msgs)
+
+    def send_adhoc_message(self, system: str, msg: str, output_label:str, intervention: bool = True):
+        # sync callers, often tool hooks in worker threads, use the sync client api
+        # driving the async client from another thread's event loop would share its connections across loops
+        chain, printer, input_tokens = self._adhoc_chain(system, msg, output_label)
+        call_record = self.utility_rate_limiter.limit_call_and_input(input_tokens)
+        response = ""
+
+        for chunk in chain.stream({}):
+            if intervention and self.handle_intervention(): break # wait for intervention and handle it, if paused
+            content = self._chunk_content(chunk)
+            if printer: printer.stream(content)
+            response+=content
+
+        self.utility_rate_limiter.set_output_tokens(self.count_tokens(response), call_record)
+        return response
+
+    async def asend_adhoc_message(self, system: str, msg: str, output_label:str, intervention: bool = True):
+        chain, printer, input_tokens = self._adhoc_chain(system, msg, output_label)
+        call_record = await self.utility_rate_limiter.alimit_call_and_input(input_tokens)
+        response = ""
+
+        async for chunk in chain.astream({}):
+            if intervention and await self.ahandle_intervention(): break # wait for intervention and handle it, if paused
+            content = self._chunk_content(chunk)
+            if printer: printer.stream(content)
+            response+=content
 
-    def send_adhoc_message(self, system: str, msg: str, output_label:str):
+        self.utility_rate_limiter.set_output_tokens(self.count_tokens(response), call_record)
+        return response
+
+    def _adhoc_chain(self, system: str, msg: str, output_label: str):
         prompt = ChatPromptTemplate.from_messages([
             SystemMessage(content=system),
             HumanMessage(content=msg)])
 
         chain = prompt | self.config.utility_model
-        response = ""
         printer = None
 
         if output_label:
             PrintStyle(bold=True, font_color="orange", padding=True, background_color="white").print(f"{self.agent_name}: {output_label}:")
             printer = PrintStyle(italic=True, font_color="orange", padding=False)                
 
-        formatted_inputs = prompt.format()
-        tokens = int(len(formatted_inputs)/4)     
-        self.rate_limiter.limit_call_and_input(tokens)
-    
-        for chunk in chain.stream({}):
-            if self.handle_intervention(): break # wait for intervention and handle it, if paused
-
-            if isinstance(chunk, str): content = chunk
-            elif hasattr(chunk, "content"): content = str(chunk.content)
-            else: content = str(chunk)
-
-            if printer: printer.stream(content)
-            response+=content
-
-        self.rate_limiter.set_output_tokens(int(len(response)/4))
+        return chain, printer, self.count_tokens(system) + self.count_tokens(msg) + 2 * tokens.MESSAGE_OVERHEAD
 
-        return response
+    def _chunk_content(self, chunk) -> str:
+        if isinstance(chunk, str): return chunk
+        if hasattr(chunk, "content"): return str(chunk.content)
+        return str(chunk)
             
     def get_last_message(self):
         if self.history:
             return self.history[-1]
 
-    def replace_middle_messages(self,middle_messages):
+    def replace_middle_messages(self, middle_messages):
+        system, msg = self._cleanup_request(middle_messages)
+        summary = self.send_adhoc_message(system=system, msg=msg, output_label="Mid messages cleanup summary")
+        return [HumanMessage(content=summary)]
+
+    async def areplace_middle_messages(self, middle_messages):
+        # background variant, no output label so it does not interleave with the streamed reply
+        system, msg = self._cleanup_request(middle_messages)
+        summary = await self.asend_adhoc_message(system=system, msg=msg, output_label="", intervention=False)
+        return [HumanMessage(content=summary)]
+
+    def _cleanup_request(self, middle_messages) -> tuple[str, str]:
+        summary_index = next((i for i, msg in enumerate(middle_messages) if msg is self.history_summary), -1)
+
+        if self.config.msgs_cleanup_incremental and summary_index >= 0:
+            # only the newly evicted messages are merged into the existing rolling summary
+            new_messages = middle_messages[:summary_index] + middle_messages[summary_index+1:]
+            update_prompt = files.read_file("./prompts/fw.msg_cleanup_update.md")
+            input = {
+                "previous_summary": self.history_summary.content, # type: ignore
+                "new_messages": self.concat_messages(new_messages)
+            }
+            return update_prompt, json.dumps(input)
+
         cleanup_prompt = files.read_file("./prompts/fw.msg_cleanup.md")
-        summary = self.send_adhoc_message(system=cleanup_prompt,msg=self.concat_messages(middle_messages), output_label="Mid messages cleanup summary")
-        new_human_message = HumanMessage(content=summary)
-        return [new_human_message]
+        return cleanup_prompt, self.concat_messages(middle_messages)
 
     def cleanup_history(self, max:int, keep_start:int, keep_end:int):
-        
+        self.apply_history_cleanup()
+
         if len(self.history) <= max:
             return self.history
 
+        if self.cleanup_task:
+            return self.history # older messages are still being summarized, keep raw history meanwhile
+
         first_x = self.history[:keep_start]
-        last_y = self.history[-keep_end:]
 
         # Identify the middle part
         middle_part = self.history[keep_start:-keep_end]
@@ -251,15 +423,81 @@ class Agent:
         if len(middle_part) % 2 == 0:
             middle_part = middle_part[:-1]
 
-        # Replace the middle part using the replacement function
-        new_middle_part = self.replace_middle_messages(middle_part)
-
-        self.history = first_x + new_middle_part + last_y
+        self.summarize_messages(middle_part)
+        return self.history
 
+    def cleanup_history_by_tokens(self):
+        self.apply_history_cleanup()
+        if self.cleanup_task:
+            return self.history # older messages are still being summarized, keep raw history meanwhile
+
+        window = context_window.ContextWindow(
+            self.config.context_budget_tokens,
+            keep_start_ratio=self.config.context_keep_start_ratio,
+            keep_end_ratio=self.config.context_keep_end_ratio,
+            max_message_ratio=self.config.context_max_message_ratio,
+            tokenizer=self.config.tokenizer,
+            token_counts=self.token_counts)
+        protected = [self.history_summary] if self.history_summary else []
+        self.context_plan = window.plan(self.history, protected)
+
+        # truncate oversized older messages, new message objects so their token counts are recomputed
+        max_chars = window.max_message_tokens * tokens.CHARS_PER_TOKEN
+        for i in self.context_plan.indices(context_window.COMPRESS):
+            msg = self.history[i]
+            content = messages.truncate_text(str(msg.content), max_chars)
+            if content != msg.content: self.history[i] = type(msg)(content=content)
+
+        middle_part = [self.history[i] for i in self.context_plan.indices(context_window.SUMMARIZE)]
+        self.summarize_messages(middle_part)
         return self.history
 
+    def summarize_messages(self, middle_part: list):
+        if not middle_part:
+            return
+
+        # Replace the middle part using the replacement function, off the critical path if enabled
+        # the background summary is a task on the agent's own event loop, where its async model client lives
+        if self.config.msgs_cleanup_background and self.loop and not self.loop.is_closed():
+            coro = self.areplace_middle_messages(middle_part)
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self.loop: self.cleanup_task = self.loop.create_task(coro)
+            else: self.cleanup_task = asyncio.run_coroutine_threadsafe(coro, self.loop) # from a tool's worker thread
+            self.cleanup_task_messages = middle_part
+        else:
+            self.replace_messages(middle_part, self.replace_middle_messages(middle_part))
+
+    def apply_history_cleanup(self):
+        # swap the summarized messages for their summary once the background task is done
+        task = self.cleanup_task
+        if not task or not task.done(): return
+        self.cleanup_task = None
+        try:
+            self.replace_messages(self.cleanup_task_messages, task.result())
+        except Exception as e:
+            PrintStyle.error("History cleanup failed: " + errors.format_error(e))
+        self.cleanup_task_messages = []
+
+    def replace_messages(self, old_messages: list, new_messages: list):
+        # messages are matched by identity, history may have grown since the replacement was computed
+        start = next((i for i, msg in enumerate(self.history) if msg is old_messages[0]), -1)
+        if start < 0 or any(a is not b for a, b in zip(self.history[start:start+len(old_messages)], old_messages)):
+            return # history was reset or changed meanwhile, the summary no longer applies
+        self.history = self.history[:start] + new_messages + self.history[start+len(old_messages):]
+        self.history_summary = new_messages[0] if new_messages else None
+
     def handle_intervention(self, progress:str="") -> bool:
         while self.paused: time.sleep(0.1) # wait if paused
+        return self.process_intervention(progress)
+
+    async def ahandle_intervention(self, progress:str="") -> bool:
+        while self.paused: await asyncio.sleep(0.1) # wait if paused, without blocking other agents
+        return self.process_intervention(progress)
+
+    def process_intervention(self, progress:str="") -> bool:
         if self.intervention_message and not self.intervention_status: # if there is an intervention message, but not yet processed
             if progress.strip(): self.append_message(progress) # append the response generated so far
             user_msg = files.read_file("./prompts/fw.intervention.md", user_message=self.intervention_message) # format the user intervention template
@@ -268,9 +506,12 @@ class Agent:
             self.intervention_status = True
         return self.intervention_status # return intervention status
 
-    def process_tools(self, msg: str):
-        # search for tool usage requests in agent message
-        tool_request = extract_tools.json_parse_dirty(msg)
+    def process_tools(self, msg: str, tool_request: dict[str, Any] | None = None):
+        return asyncio_utils.run_sync(self.aprocess_tools(msg, tool_request))
+
+    async def aprocess_tools(self, msg: str, tool_request: dict[str, Any] | None = None):
+        # search for tool usage requests in agent message, unless already parsed while streaming
+        if tool_request is None: tool_request = extract_tools.json_parse_dirty(msg)
 
         if tool_request is not None:
             tool_name = tool_request.get("tool_name", "")
@@ -281,13 +522,13 @@ class Agent:
                         tool_args,
                         msg)
                 
-            if self.handle_intervention(): return # wait if paused and handle intervention message if needed
-            tool.before_execution(**tool_args)
-            if self.handle_intervention(): return # wait if paused and handle intervention message if needed
-            response = tool.execute(**tool_args)
-            if self.handle_intervention(): return # wait if paused and handle intervention message if needed
-            tool.after_execution(response)
-            if self.handle_intervention(): return # wait if paused and handle intervention message if needed
+            if await self.ahandle_intervention(): return # wait if paused and handle intervention message if needed
+            await tool.abefore_execution(**tool_args) # may wait for a pause, off the event loop
+            if await self.ahandle_intervention(): return # wait if paused and handle intervention message if needed
+            response = await tool.aexecute(**tool_args)
+            if await self.ahandle_intervention(): return # wait if paused and handle intervention message if needed
+            await asyncio.to_thread(tool.after_execution, response) # may summarize history, with the sync utility model client
+            if await self.ahandle_intervention(): return # wait if paused and handle intervention message if needed
             if response.break_loop: return response.message
         else:
             msg = files.read_file("prompts/fw.msg_misformat.md")
@@ -297,40 +538,51 @@ class Agent:
 
     def get_tool(self, name: str, args: dict, message: str, **kwargs):
         from python.tools.unknown import Unknown 
-        from python.helpers.tool import Tool
+        from python.helpers import tool_registry
         
-        tool_class = Unknown
-        if files.exists("python/tools",f"{name}.py"): 
-            module = importlib.import_module("python.tools." + name)  # Import the module
-            class_list = inspect.getmembers(module, inspect.isclass)  # Get all functions in the module
-
-            for cls in class_list:
-                if cls[1] is not Tool and issubclass(cls[1], Tool):
-                    tool_class = cls[1]
-                    break
-
+        tool_class = tool_registry.get(name, hot_reload=self.config.tool_hot_reload) or Unknown
         return tool_class(agent=self, name=name, args=args, message=message, **kwargs)
 
     def fetch_memories(self,reset_skip=False):
+        return asyncio_utils.run_sync(self.afetch_memories(reset_skip))
+
+    async def afetch_memories(self,reset_skip=False) -> str | None:
         if self.config.auto_memory_count<=0: return ""
         if reset_skip: self.memory_skip_counter = 0
 
         if self.memory_skip_counter > 0:
             self.memory_skip_counter-=1
-            return ""
+            return None
         else:
             self.memory_skip_counter = self.config.auto_memory_skip
-            from python.tools import memory_tool
+            # vector search and embeddings are sync calls, no async client is driven from the worker thread
+            results = await asyncio.to_thread(self.memory_retriever.retrieve, self.history)
+            results = [(doc, score) for doc, score in results if score >= self.config.auto_memory_threshold]
+            if not results: return "" # nothing relevant, skip the cleanup call
+
+            if self.config.auto_memory_cleanup == "none":
+                return str([doc for doc, _ in results])
+            if self.config.auto_memory_cleanup == "extractive":
+                return memory_query.extractive_filter(results, self.history, self.config.auto_memory_turns)
+
             messages = self.concat_messages(self.history)
-            memories = memory_tool.search(self,messages)
+            cache_key = (tuple(doc.metadata.get("id", doc.page_content) for doc, _ in results), hash(messages))
+            if cache_key in self.memory_cleanup_cache:
+                return self.memory_cleanup_cache[cache_key]
+
             input = {
                 "conversation_history" : messages,
-                "raw_memories": memories
+                "raw_memories": str([doc for doc, _ in results])
             }
             cleanup_prompt = files.read_file("./prompts/msg.memory_cleanup.md").replace("{", "{{")       
-            clean_memories = self.send_adhoc_message(cleanup_prompt,json.dumps(input), output_label="Memory injection")
+            clean_memories = await self.asend_adhoc_message(cleanup_prompt,json.dumps(input), output_label="Memory injection")
+            self.memory_cleanup_cache = {cache_key: clean_memories} # only the latest is ever reused
             return clean_memories
 
+    def search_memories(self, query: str):
+        from python.tools import memory_tool
+        return memory_tool.search_with_scores(self, query, self.config.auto_memory_count)
+
     def call_extension(self, name: str, **kwargs) -> Any:
         pass
 
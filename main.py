@@ -151,7 +151,7 @@ def chat(agent:Agent):
 
 # User intervention during agent streaming
 def intervention():
-    if Agent.streaming_agent and not Agent.paused:
+    if Agent.streaming_agents and not Agent.paused:
         Agent.paused = True # stop agent streaming
         PrintStyle(background_color="#6C3483", font_color="white", bold=True, padding=True).print(f"User intervention ('e' to leave, empty to continue):")        
 
@@ -160,7 +160,8 @@ def intervention():
         PrintStyle(font_color="white", padding=False, log_only=True).print(f"> {user_input}")        
         
         if user_input.lower() == 'e': os._exit(0) # exit the conversation when the user types 'exit'
-        if user_input: Agent.streaming_agent.intervention_message = user_input # set intervention message if non-empty
+        if user_input: # set intervention message if non-empty, each parallel subordinate gets it
+            for agent in Agent.working_agents(): agent.intervention_message = user_input
         Agent.paused = False # continue agent streaming 
     
 
@@ -173,7 +174,7 @@ def capture_keys():
             intervent = False
             time.sleep(0.1)
             
-            if Agent.streaming_agent:
+            if Agent.streaming_agents:
                 # with raw_input, application_keypad, mouse_input:
                 with input_lock, raw_input, application_keypad:
                     event: InputEvent | None = get_input_event(timeout=0.1)
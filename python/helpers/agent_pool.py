@@ -0,0 +1,38 @@
+import threading
+from collections import defaultdict
+from agent import Agent, AgentConfig
+
+
+class AgentPool:
+    """
+    Finished subordinates kept per agent number (delegation depth) and handed out again after a reset,
+    so they keep their prompts, rate limiters and started code execution container, with fresh sessions.
+    """
+
+    def __init__(self):
+        self.idle: dict[int, list[Agent]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def acquire(self, number: int, config: AgentConfig) -> Agent:
+        with self.lock:
+            idle = self.idle[number]
+            for i, agent in enumerate(idle):
+                if agent.config is config:
+                    return idle.pop(i)
+        return Agent(number, config)
+
+    def release(self, agent: Agent):
+        # its own subordinates are done as well, they go back first
+        subordinate = agent.get_data("subordinate")
+        if isinstance(subordinate, Agent): self.release(subordinate)
+        agent.reset()
+        with self.lock:
+            idle = self.idle[agent.number]
+            if len(idle) < agent.config.subordinate_pool_size:
+                idle.append(agent)
+                return
+        agent.close() # pool is full, its container is released now instead of whenever it is garbage collected
+
+
+# shared by all delegations in the process
+pool = AgentPool()
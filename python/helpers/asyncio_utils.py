@@ -0,0 +1,22 @@
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+_local = threading.local()
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    # run a coroutine to completion from sync code
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # each thread keeps its own loop, so async model clients and their connection pools stay usable between calls
+        loop = getattr(_local, "loop", None)
+        if loop is None or loop.is_closed():
+            loop = _local.loop = asyncio.new_event_loop()
+        return loop.run_until_complete(coro)
+
+    # called from inside a running loop (sync code nested in async code), run on a separate thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_sync, coro).result()
@@ -0,0 +1,84 @@
+from dataclasses import dataclass, field
+from langchain_core.messages import BaseMessage
+from . import tokens
+
+KEEP = "keep"
+COMPRESS = "compress"
+SUMMARIZE = "summarize"
+
+@dataclass
+class ContextDecision:
+    index: int
+    action: str
+    tokens: int
+
+@dataclass
+class ContextPlan:
+    budget: int
+    total_tokens: int
+    decisions: list[ContextDecision] = field(default_factory=list)
+
+    def indices(self, action: str) -> list[int]:
+        return [d.index for d in self.decisions if d.action == action]
+
+    @property
+    def over_budget(self) -> bool:
+        return self.total_tokens > self.budget
+
+    def __str__(self):
+        counts = {action: len(self.indices(action)) for action in (KEEP, COMPRESS, SUMMARIZE)}
+        return f"{self.total_tokens}/{self.budget} tokens, " + ", ".join(f"{count} {action}" for action, count in counts.items())
+
+
+class ContextWindow:
+    """
+    Decides which history messages to keep, compress or summarize so the history fits a token budget.
+    The start and the end of the conversation are kept up to their share of the budget, oversized older
+    messages are compressed and everything in between is summarized.
+    """
+
+    def __init__(self, budget_tokens: int, keep_start_ratio: float = 0.2, keep_end_ratio: float = 0.5, max_message_ratio: float = 0.25, tokenizer: str = "cl100k_base",
+                 token_counts: tokens.MessageTokenCounts | None = None):
+        self.budget_tokens = budget_tokens
+        self.keep_start_tokens = int(budget_tokens * keep_start_ratio)
+        self.keep_end_tokens = int(budget_tokens * keep_end_ratio)
+        self.max_message_tokens = int(budget_tokens * max_message_ratio)
+        self.tokenizer = tokenizer
+        self.token_counts = token_counts or tokens.MessageTokenCounts(tokenizer) # the agent's memoized counts, if given
+
+    def plan(self, messages: list[BaseMessage], protected: list[BaseMessage] = []) -> ContextPlan:
+        # protected messages (like the rolling summary) are never compressed
+        counts = [self.token_counts.count(msg) for msg in messages]
+        plan = ContextPlan(budget=self.budget_tokens, total_tokens=sum(counts))
+        actions = [KEEP] * len(messages)
+
+        # the latest messages are kept as they are, up to the end budget but at least one
+        end_start = len(messages)
+        used = 0
+        while end_start > 0 and (end_start == len(messages) or used + counts[end_start-1] <= self.keep_end_tokens):
+            end_start -= 1
+            used += counts[end_start]
+
+        for i in range(end_start):
+            if counts[i] > self.max_message_tokens and not any(messages[i] is p for p in protected):
+                actions[i] = COMPRESS
+
+        if plan.over_budget:
+            # the beginning of the conversation is kept up to the start budget but at least one message
+            start_end = 0
+            used = 0
+            while start_end < end_start and (start_end == 0 or used + counts[start_end] <= self.keep_start_tokens):
+                used += counts[start_end]
+                start_end += 1
+
+            # the summary replaces the middle with a human message, keep human/ai alternation intact
+            # by keeping the reply as well, moving back could put the first message, the user's task, into the summary
+            if start_end < end_start and messages[start_end].type != "human":
+                start_end += 1
+            if (end_start - start_end) % 2 == 0:
+                end_start -= 1
+            for i in range(start_end, end_start):
+                actions[i] = SUMMARIZE
+
+        plan.decisions = [ContextDecision(i, action, counts[i]) for i, action in enumerate(actions)]
+        return plan
@@ -1,10 +1,52 @@
 import time
 import docker
 import atexit
-from typing import Dict, Optional
-from python.helpers.files import get_abs_path
+import codecs, shlex, struct
+from typing import Callable, Dict, Optional
+from python.helpers.files import get_abs_path, read_file
 from python.helpers.errors import format_error
 from python.helpers.print_style import PrintStyle
+from python.helpers.messages import BoundedOutput
+
+
+class ExecSocket:
+    """
+    Attached docker exec stream. Docker multiplexes stdout and stderr into frames
+    with an 8 byte header: stream type, 3 zero bytes and payload size.
+    """
+
+    def __init__(self, socket):
+        self.socket = getattr(socket, "_sock", socket) # raw socket under the docker-py wrapper
+        self.buffer = bytearray() # consumed frames are cut from the front, no copying of the whole stream
+
+    def send(self, data: bytes):
+        self.socket.sendall(data)
+
+    def read_frame(self, deadline: float | None = None) -> bytes | None:
+        # payload of the next frame, None when the stream ended, raises TimeoutError past the deadline (time.monotonic)
+        while True:
+            if len(self.buffer) >= 8:
+                size = struct.unpack(">I", self.buffer[4:8])[0]
+                if len(self.buffer) >= 8 + size:
+                    payload = bytes(self.buffer[8:8 + size])
+                    del self.buffer[:8 + size]
+                    return payload
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise TimeoutError()
+                self.socket.settimeout(remaining)
+            else:
+                self.socket.settimeout(None)
+            chunk = self.socket.recv(65536)
+            if not chunk: return None
+            self.buffer += chunk
+
+    def close(self):
+        try:
+            self.socket.close()
+        except Exception:
+            pass
+
 
 class DockerContainerManager:
     def __init__(self, image: str, name: str, ports: Optional[Dict[str, int]] = None, volumes: Optional[Dict[str, Dict[str, str]]] = None):
@@ -66,7 +108,6 @@ class DockerContainerManager:
             if self.container.status != 'running':
                 print(f"Starting existing container: {self.name} for safe code execution...")
                 self.container.start()
-            time.sleep(2)
         else:
             print(f"Initializing docker container {self.name} for safe code execution...")
             self.container = self.client.containers.run(
@@ -78,14 +119,42 @@ class DockerContainerManager:
             )
             atexit.register(self.cleanup_container)
             print(f"Started container with ID: {self.container.id}")
-            time.sleep(5)
+        self.wait_ready()
+
+    def wait_ready(self, timeout: float = 60, probe: str = "true") -> None:
+        """
+        Wait until the container is running and executes commands, polling with a growing delay.
+
+        Args:
+            timeout (float, optional): Seconds to wait before giving up.
+            probe (str, optional): Command that succeeds once the container is ready.
 
-    def execute_command(self, command: str) -> str:
+        Raises:
+            Exception: If the container is not ready in time.
         """
-        Execute a command in the Docker container.
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            try:
+                self.container.reload() # type: ignore
+                if self.container.status == "running" and self.container.exec_run(probe).exit_code == 0: # type: ignore
+                    return
+            except docker.errors.APIError:
+                pass # not accepting exec yet
+            if time.monotonic() > deadline:
+                raise Exception(f"Docker container {self.name} is not ready after {timeout} seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+
+    def execute_command(self, command: str, timeout: int = 0, max_output_bytes: int = 0, on_output: Callable[[str], None] | None = None) -> str:
+        """
+        Execute a command in the Docker container, streaming its output.
 
         Args:
             command (str): The command to execute.
+            timeout (int, optional): Seconds after which the command is killed, 0 for no limit.
+            max_output_bytes (int, optional): Output kept in memory, the start and the end of longer output is kept. 0 keeps everything.
+            on_output (Callable[[str], None], optional): Called with each piece of output as it arrives.
 
         Returns:
             str: The output of the command, or an error message if the command failed.
@@ -96,16 +165,34 @@ class DockerContainerManager:
         if not self.container:
             raise Exception("Docker container is not initialized or started")
 
-        exec_result = self.container.exec_run(command, demux=True)
-        exit_code, output = exec_result.exit_code, exec_result.output
-
+        if timeout > 0:
+            # killed inside the container as well, so a runaway command does not outlive the call
+            command = f"timeout -s KILL {timeout} sh -c {shlex.quote(command)}"
+
+        api = self.client.api
+        exec_id = api.exec_create(self.container.id, command, stdout=True, stderr=True)["Id"]
+        stream = ExecSocket(api.exec_start(exec_id, socket=True))
+        output = BoundedOutput(max_output_bytes)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        start = time.monotonic()
+        deadline = start + timeout + 5 if timeout > 0 else None # grace period for the kill to close the stream
+        try:
+            while (frame := stream.read_frame(deadline)) is not None:
+                output.append(frame)
+                if on_output: on_output(decoder.decode(frame))
+        except TimeoutError:
+            pass
+        finally:
+            stream.close()
+
+        text = output.text()
+        exit_code = api.exec_inspect(exec_id)["ExitCode"]
+        if timeout > 0 and time.monotonic() - start >= timeout and exit_code != 0:
+            return text + "\n" + read_file("./prompts/fw.code_timeout.md", seconds=timeout)
         if exit_code == 0:
-            stdout, stderr = output
-            return stdout.decode('utf-8') if stdout else stderr.decode('utf-8') if stderr else "Command executed successfully, but produced no output."
+            return text if text else "Command executed successfully, but produced no output."
         else:
-            stdout, stderr = output
-            error_message = stderr.decode('utf-8') if stderr else stdout.decode('utf-8') if stdout else "Unknown error occurred"
-            return f"Error (exit code {exit_code}): {error_message}"
+            return f"Error (exit code {exit_code}): {text if text else 'Unknown error occurred'}"
 
     def cleanup_container(self) -> None:
         """
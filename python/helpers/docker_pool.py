@@ -0,0 +1,92 @@
+import atexit, threading, uuid
+from collections import deque
+from typing import Dict, Optional
+from python.helpers.docker import DockerContainerManager
+from python.helpers.print_style import PrintStyle
+from python.helpers import docker_session
+
+
+class ContainerPool:
+    """
+    Pre-started sandbox containers leased to agents, one container per agent.
+    Returned containers are removed and replaced by fresh ones in the background,
+    so no state of one agent leaks to the next and a lease is ready without waiting.
+    """
+
+    def __init__(self, image: str, name: str, size: int, volumes: Optional[Dict[str, Dict[str, str]]] = None, ports: Optional[Dict[str, int]] = None):
+        self.image = image
+        self.name = name
+        self.size = size
+        self.volumes = volumes
+        # fixed host ports can only be bound once, pooled containers get random host ports
+        self.ports = {port: None for port in ports} if ports else None
+        self.idle: deque[DockerContainerManager] = deque()
+        self.leased: set[str] = set()
+        self.starting = 0
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start(self) -> DockerContainerManager:
+        manager = DockerContainerManager(image=self.image, name=f"{self.name}-{uuid.uuid4().hex[:8]}", ports=self.ports, volumes=self.volumes) # type: ignore
+        manager.start_container()
+        return manager
+
+    def _fill(self):
+        try:
+            manager = self._start()
+            with self.lock:
+                self.idle.append(manager)
+        except Exception as e:
+            PrintStyle.error(f"Failed to start pooled container: {e}")
+        finally:
+            with self.lock:
+                self.starting -= 1
+
+    def warm_up(self):
+        with self.lock:
+            missing = max(0, self.size - len(self.idle) - self.starting)
+            self.starting += missing
+        for _ in range(missing):
+            threading.Thread(target=self._fill, daemon=True).start()
+
+    def lease(self) -> DockerContainerManager:
+        with self.lock:
+            manager = self.idle.popleft() if self.idle else None
+        if manager is None:
+            manager = self._start() # pool exhausted, start one on demand
+        with self.lock:
+            self.leased.add(manager.name)
+        self.warm_up()
+        return manager
+
+    def release(self, manager: DockerContainerManager):
+        # recycle in the background, the agent does not wait for the removal
+        with self.lock:
+            self.leased.discard(manager.name)
+        threading.Thread(target=self._recycle, args=(manager,), daemon=True).start()
+
+    def _recycle(self, manager: DockerContainerManager):
+        docker_session.discard_pool(manager.name)
+        manager.cleanup_container()
+        self.warm_up()
+
+    def close(self):
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+            self.size = 0 # no refills while shutting down
+        for manager in idle:
+            manager.cleanup_container()
+
+
+# one pool per image and container name
+pools: dict[tuple[str, str], ContainerPool] = {}
+pools_lock = threading.Lock()
+
+def get_pool(image: str, name: str, size: int, volumes: Optional[Dict[str, Dict[str, str]]] = None, ports: Optional[Dict[str, int]] = None) -> ContainerPool:
+    with pools_lock:
+        key = (image, name)
+        if key not in pools:
+            pools[key] = ContainerPool(image, name, size, volumes, ports)
+            pools[key].warm_up()
+        return pools[key]
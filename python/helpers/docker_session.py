@@ -0,0 +1,174 @@
+import codecs, json, re, shlex, threading, time, uuid
+from collections import deque
+from typing import Callable
+from python.helpers.docker import DockerContainerManager, ExecSocket
+from python.helpers.files import read_file
+from python.helpers.messages import BoundedOutput
+from python.helpers.print_style import PrintStyle
+from python.helpers.shell_io import SentinelScanner
+
+# interpreters started once inside the container, reading one json request per line from stdin
+# and writing the request marker on its own line when the code is done, globals persist between requests
+PYTHON_SERVER = """
+import sys, json, traceback
+namespace = {"__name__": "__main__"}
+for line in sys.stdin:
+    request = json.loads(line)
+    try:
+        exec(compile(request["code"], "<session>", "exec"), namespace)
+    except SystemExit:
+        pass
+    except BaseException:
+        traceback.print_exc()
+    sys.stdout.write("\\n" + request["marker"] + "\\n")
+    sys.stdout.flush()
+"""
+
+# nodejs runs one process per call, a shared global scope rejects re-declared top-level const, let and class
+# when a snippet is run again, and callbacks still pending after the snippet would print into the next call
+SERVERS = {
+    "python": f"python3 -u -c {shlex.quote(PYTHON_SERVER)}",
+}
+
+
+class SessionClosed(Exception):
+    pass
+
+
+class Session:
+    """
+    Long-lived interpreter inside the container, talking over the docker exec socket.
+    Stderr is merged into stdout inside the container so output keeps its order.
+    """
+
+    def __init__(self, docker: DockerContainerManager, runtime: str):
+        if runtime not in SERVERS: raise ValueError(f"No persistent session for runtime '{runtime}'")
+        self.docker = docker
+        self.runtime = runtime
+        api = docker.client.api
+        # the shell prints its pid before exec replaces it with the interpreter, so a runaway session can be killed
+        command = ["sh", "-c", f"echo $$; exec {SERVERS[runtime]} 2>&1"]
+        self.exec_id = api.exec_create(docker.container.id, command, stdin=True, stdout=True, stderr=True)["Id"] # type: ignore
+        self.stream = ExecSocket(api.exec_start(self.exec_id, socket=True))
+        self.closed = False
+        first = b""
+        while b"\n" not in first:
+            frame = self.stream.read_frame(time.monotonic() + 30)
+            if frame is None: raise SessionClosed(f"{runtime} session failed to start")
+            first += frame
+        self.pid = int(first.split(b"\n")[0])
+
+    def run(self, code: str, timeout: int = 0, max_output_bytes: int = 0, on_output: Callable[[str], None] | None = None) -> str:
+        if self.closed: raise SessionClosed(f"{self.runtime} session ended")
+        marker = f"--session-done-{uuid.uuid4().hex}--"
+        self.stream.send((json.dumps({"code": code, "marker": marker}) + "\n").encode("utf-8"))
+        scanner = SentinelScanner(marker.encode(), re.compile(rb"\n" + re.escape(marker.encode()) + rb"\n"))
+        output = BoundedOutput(max_output_bytes)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+
+        def emit(data: bytes):
+            output.append(data)
+            if on_output and data: on_output(decoder.decode(data))
+
+        while True:
+            try:
+                frame = self.stream.read_frame(deadline)
+            except TimeoutError:
+                emit(scanner.flush())
+                self.kill()
+                return output.text() + "\n" + read_file("./prompts/fw.code_timeout.md", seconds=timeout)
+            if frame is None:
+                # the code ended the interpreter, e.g. with os._exit, return what it printed
+                self.closed = True
+                emit(scanner.flush())
+                return output.text()
+            emit(scanner.feed(frame))
+            if scanner.match:
+                return output.text()
+
+    def kill(self):
+        # interrupting code is not possible over the protocol, the interpreter is killed and the session replaced on next use
+        try:
+            self.docker.container.exec_run(f"kill -9 {self.pid}") # type: ignore
+        except Exception as e:
+            PrintStyle.error(f"Failed to kill {self.runtime} session: {e}")
+        self.close()
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        self.stream.close() # closes stdin, the server loop ends with it
+
+
+class SessionPool:
+    """
+    Keeps started and preloaded sessions ready for each runtime, so an agent gets a warm
+    interpreter on its first call. Taken sessions are replaced in the background.
+    """
+
+    def __init__(self, docker: DockerContainerManager, size: int = 1, preload: dict[str, str] | None = None):
+        self.docker = docker
+        self.size = size
+        self.preload = preload or {}
+        self.idle: dict[str, deque[Session]] = {runtime: deque() for runtime in SERVERS}
+        self.starting: dict[str, int] = {runtime: 0 for runtime in SERVERS}
+        self.lock = threading.Lock()
+
+    def _start(self, runtime: str) -> Session:
+        session = Session(self.docker, runtime)
+        if self.preload.get(runtime):
+            session.run(self.preload[runtime])
+        return session
+
+    def _fill(self, runtime: str):
+        try:
+            session = self._start(runtime)
+            with self.lock:
+                self.idle[runtime].append(session)
+        except Exception as e:
+            PrintStyle.error(f"Failed to start {runtime} session: {e}")
+        finally:
+            with self.lock:
+                self.starting[runtime] -= 1
+
+    def warm_up(self, runtime: str | None = None):
+        for name in [runtime] if runtime else list(SERVERS):
+            with self.lock:
+                missing = self.size - len(self.idle[name]) - self.starting[name]
+                self.starting[name] += max(0, missing)
+            for _ in range(missing):
+                threading.Thread(target=self._fill, args=(name,), daemon=True).start()
+
+    def acquire(self, runtime: str) -> Session:
+        with self.lock:
+            session = self.idle[runtime].popleft() if self.idle[runtime] else None
+        if session is None:
+            session = self._start(runtime)
+        self.warm_up(runtime)
+        return session
+
+    def close(self):
+        with self.lock:
+            sessions = [session for idle in self.idle.values() for session in idle]
+            for idle in self.idle.values(): idle.clear()
+        for session in sessions:
+            session.close()
+
+
+# one pool per container, shared by all agents using it
+pools: dict[str, SessionPool] = {}
+pools_lock = threading.Lock()
+
+def get_pool(docker: DockerContainerManager, size: int = 1, preload: dict[str, str] | None = None) -> SessionPool:
+    with pools_lock:
+        if docker.name not in pools:
+            pools[docker.name] = SessionPool(docker, size, preload)
+            pools[docker.name].warm_up()
+        return pools[docker.name]
+
+def discard_pool(name: str):
+    # the container is going away, its idle sessions go with it
+    with pools_lock:
+        pool = pools.pop(name, None)
+    if pool: pool.close()
@@ -0,0 +1,91 @@
+import shlex
+from abc import ABC, abstractmethod
+from typing import Callable
+from python.helpers.docker import DockerContainerManager
+from python.helpers.docker_session import Session, SessionPool, SERVERS
+from python.helpers.shell_session import InteractiveSession
+
+DOCKER = "docker"
+LOCAL = "local"
+SSH = "ssh"
+
+
+def shell_command(runtime: str, code: str) -> str | None:
+    # command line running the code with the runtime, None for an unknown runtime
+    if runtime == "python": return f'python3 -c {shlex.quote(code)}'
+    if runtime == "nodejs": return f'node -e {shlex.quote(code)}'
+    if runtime == "terminal": return code
+    return None
+
+
+class ExecBackend(ABC):
+    """
+    Where the code execution tool runs code. Each agent has its own backend instance.
+    Output is passed to on_output as it arrives, runs are bounded by timeout seconds
+    and by max_output_bytes of kept output (0 means no limit).
+    """
+
+    @abstractmethod
+    def run(self, runtime: str, code: str, timeout: int = 0, max_output_bytes: int = 0, on_output: Callable[[str], None] | None = None) -> str:
+        pass
+
+    def reset(self):
+        # clear interpreter and shell state for the next task, the backend stays usable
+        pass
+
+    def close(self):
+        pass
+
+
+class DockerBackend(ExecBackend):
+
+    def __init__(self, docker: DockerContainerManager, pool: SessionPool | None = None, release: Callable[[], None] | None = None):
+        self.docker = docker
+        self.pool = pool
+        self.release = release # returns a leased container to its pool
+        self.sessions: dict[str, Session] = {} # persistent interpreter per runtime
+
+    def run(self, runtime, code, timeout=0, max_output_bytes=0, on_output=None):
+        if self.pool and runtime in SERVERS:
+            # variables and imports of previous calls are kept, a session that ended is replaced by a fresh one
+            session = self.sessions.get(runtime)
+            if not session or session.closed:
+                session = self.pool.acquire(runtime)
+                self.sessions[runtime] = session
+            return session.run(code, timeout, max_output_bytes, on_output)
+        return self.docker.execute_command(shell_command(runtime, code), timeout, max_output_bytes, on_output) # type: ignore
+
+    def reset(self):
+        # fresh sessions are taken from the pool on next use, files written to the container are kept
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+    def close(self):
+        self.reset()
+        if self.release:
+            release, self.release = self.release, None
+            release()
+
+
+class ShellBackend(ExecBackend):
+    # local or ssh shell, the shell state persists, python and nodejs code runs as one process per call
+
+    def __init__(self, session: InteractiveSession):
+        self.session = session
+        self.session.connect()
+        self.connected = True
+
+    def run(self, runtime, code, timeout=0, max_output_bytes=0, on_output=None):
+        if not self.connected:
+            self.session.connect()
+            self.connected = True
+        return self.session.run(shell_command(runtime, code), timeout, max_output_bytes, on_output) # type: ignore
+
+    def reset(self):
+        # a new shell on next use, working directory and variables of the previous task are gone
+        self.close()
+
+    def close(self):
+        if self.connected: self.session.close()
+        self.connected = False
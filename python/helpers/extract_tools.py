@@ -14,6 +14,55 @@ def json_parse_dirty(json:str) -> dict[str,Any] | None:
         if isinstance(data,dict): return data
     return None
 
+class StreamingToolParser:
+    # scans a streamed reply chunk by chunk and parses the first top-level json object
+    # as soon as its closing brace arrives, without re-scanning text already seen
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.length = 0
+        self.start = -1 # offset of the first "{"
+        self.end = -1 # offset right after the matching "}"
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.result: dict[str,Any] | None = None
+
+    def feed(self, chunk: str) -> dict[str,Any] | None:
+        offset = self.length
+        self.chunks.append(chunk)
+        self.length += len(chunk)
+        if self.end >= 0: return self.result # object already complete, just collect trailing text
+
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped: self.escaped = False
+                elif char == "\\": self.escaped = True
+                elif char == '"': self.in_string = False
+            elif char == '"':
+                if self.start >= 0: self.in_string = True
+            elif char == "{":
+                if self.start < 0: self.start = offset + i
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = offset + i + 1
+                    data = DirtyJson.parse_string(self.text[self.start:self.end])
+                    if isinstance(data,dict): self.result = data
+                    return self.result
+        return None
+
+    @property
+    def text(self) -> str:
+        if len(self.chunks) > 1: self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    @property
+    def completed_text(self) -> str:
+        # reply up to and including the parsed object, trailing text is dropped
+        return self.text[:self.end] if self.end >= 0 else self.text
+
 def extract_json_object_string(content):
     start = content.find('{')
     if start == -1:
@@ -1,20 +1,40 @@
-import os, re, sys
+import os, re, sys, time
+
+TEMPLATE_CHECK_INTERVAL = 1.0 # seconds between mtime checks of a cached template
+
+placeholder_pattern = re.compile(r"\{\{(\w+)\}\}")
+
+# absolute path -> (mtime, last mtime check, content, parts split by placeholder_pattern)
+_templates: dict[str, tuple[int, float, str, list[str]]] = {}
 
 def read_file(relative_path, **kwargs):
     absolute_path = get_abs_path(relative_path)  # Construct the absolute path to the target file
+    content, parts = load_template(absolute_path)
+    if not kwargs: return content
+
+    # Replace placeholders with values from kwargs in a single pass,
+    # parts alternate literal text and placeholder names, unknown placeholders are kept as they are
+    return "".join(
+        part if i % 2 == 0 else str(kwargs[part]) if part in kwargs else "{{" + part + "}}"
+        for i, part in enumerate(parts))
+
+def load_template(absolute_path):
+    # file contents are cached pre-parsed and re-read only when the file changes
+    now = time.monotonic()
+    cached = _templates.get(absolute_path)
+    if cached and now - cached[1] < TEMPLATE_CHECK_INTERVAL:
+        return cached[2], cached[3]
+
+    mtime = os.stat(absolute_path).st_mtime_ns
+    if cached and cached[0] == mtime:
+        _templates[absolute_path] = (mtime, now, cached[2], cached[3])
+        return cached[2], cached[3]
 
     with open(absolute_path) as f:
         content = remove_code_fences(f.read())
-
-    # Replace placeholders with values from kwargs
-    for key, value in kwargs.items():
-        placeholder = "{{" + key + "}}"
-        strval = str(value)
-        # strval = strval.encode('unicode_escape').decode('utf-8')
-        # content = re.sub(re.escape(placeholder), strval, content)
-        content = content.replace(placeholder, strval)
-
-    return content
+    parts = placeholder_pattern.split(content)
+    _templates[absolute_path] = (mtime, now, content, parts)
+    return content, parts
 
 def remove_code_fences(text):
     return re.sub(r'~~~\w*\n|~~~', '', text)
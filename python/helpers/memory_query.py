@@ -0,0 +1,98 @@
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from .messages import concat_messages
+
+FULL = "full" # whole conversation history as one query
+LAST_TURNS = "last_turns" # last N messages as one query
+KEY_PHRASES = "key_phrases" # most frequent terms of the last N messages
+MULTI = "multi" # each of the last N messages as a separate query, searched in parallel and merged by score
+
+STOPWORDS = set("""
+a about above after again against all also am an and any are as at be because been before being below between both but by can
+could did do does doing down during each few for from further had has have having he her here hers him his how i if in into is
+it its itself just me more most my no nor not now of off on once only or other our out over own same she should so some such than
+that the their them then there these they this those through to too under until up very was we were what when where which while
+who whom why will with would you your yours
+human ai tool_name tool_args thoughts response_from_tool data text message system_warning system_error true false null
+""".split())
+
+SearchFunction = Callable[[str], list[tuple[Document, float]]]
+
+class MemoryRetriever:
+    """
+    Builds memory search queries from the conversation history using the selected strategy.
+    Results of the last search are reused while the queries stay the same.
+    """
+
+    def __init__(self, search: SearchFunction, strategy: str = LAST_TURNS, turns: int = 4, count: int = 3, key_phrases: int = 12, workers: int = 4):
+        self.search = search
+        self.strategy = strategy
+        self.turns = turns
+        self.count = count
+        self.key_phrases = key_phrases
+        self.workers = workers
+        self.last_queries: list[str] = []
+        self.last_results: list[tuple[Document, float]] = []
+
+    def queries(self, history: list[BaseMessage]) -> list[str]:
+        recent = history[-self.turns:] if self.turns > 0 else history
+        if self.strategy == FULL:
+            return [concat_messages(history)]
+        elif self.strategy == KEY_PHRASES:
+            return [" ".join(extract_key_phrases(recent, self.key_phrases))]
+        elif self.strategy == MULTI:
+            return [str(msg.content) for msg in recent if str(msg.content).strip()]
+        else:
+            return [concat_messages(recent)]
+
+    def retrieve(self, history: list[BaseMessage]) -> list[tuple[Document, float]]:
+        queries = [query for query in self.queries(history) if query.strip()]
+        if queries == self.last_queries:
+            return self.last_results # history has not changed since the last search
+
+        if len(queries) <= 1:
+            results = self.search(queries[0]) if queries else []
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(queries)))) as executor:
+                results = merge_by_score(executor.map(self.search, queries))
+
+        self.last_queries = queries
+        self.last_results = results[:self.count]
+        return self.last_results
+
+
+def extract_key_phrases(messages: list[BaseMessage], count: int) -> list[str]:
+    # term frequency weighted towards the latest messages
+    scores: Counter[str] = Counter()
+    for position, msg in enumerate(messages, start=1):
+        for word in re.findall(r"[a-zA-Z][\w.\-]{2,}", str(msg.content).lower()):
+            if word not in STOPWORDS:
+                scores[word] += position
+    return [word for word, _ in scores.most_common(count)]
+
+def merge_by_score(result_lists: Any) -> list[tuple[Document, float]]:
+    # the same memory found by several queries keeps its best score
+    best: dict[str, tuple[Document, float]] = {}
+    for results in result_lists:
+        for doc, score in results:
+            key = doc.metadata.get("id", doc.page_content)
+            if key not in best or score > best[key][1]:
+                best[key] = (doc, score)
+    return sorted(best.values(), key=lambda result: result[1], reverse=True)
+
+def extractive_filter(results: list[tuple[Document, float]], history: list[BaseMessage], turns: int = 4, max_chars: int = 200) -> str:
+    # cheap alternative to the LLM memory cleanup, keeps memories sharing key terms with the recent conversation
+    key_phrases = set(extract_key_phrases(history[-turns:] if turns > 0 else history, 30))
+    lines = []
+    for doc, score in results:
+        content = doc.page_content.strip()
+        if key_phrases and not key_phrases & set(re.findall(r"[a-zA-Z][\w.\-]{2,}", content.lower())):
+            continue
+        summary = content[:max_chars] + ("..." if len(content) > max_chars else "")
+        lines.append(f"{len(lines)+1}. {' '.join(summary.split())}")
+    if not lines: return ""
+    return "\n".join(lines) + "\n\nCheck your knowledge_tool for more details."
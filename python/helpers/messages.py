@@ -1,6 +1,9 @@
 from . import files
 
 
+def concat_messages(messages):
+    return "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
+
 def truncate_text(output, threshold=1000):
     if len(output) <= threshold:
         return output
@@ -12,4 +15,42 @@ def truncate_text(output, threshold=1000):
     end_len = threshold - len(placeholder) - start_len
 
     truncated_output = output[:start_len] + placeholder + output[-end_len:]
-    return truncated_output
\ No newline at end of file
+    return truncated_output
+
+
+class BoundedOutput:
+    """
+    Collects streamed output keeping only its first and last bytes,
+    memory stays bounded however much is written. max_bytes 0 keeps everything.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.head_size = max_bytes // 2
+        self.tail_size = max_bytes - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def append(self, data: bytes):
+        self.total += len(data)
+        if self.max_bytes <= 0:
+            self.head += data
+            return
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+    def text(self) -> str:
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        removed = self.total - len(self.head) - len(self.tail)
+        if removed <= 0:
+            return head + tail
+        placeholder = files.read_file("./prompts/fw.msg_truncated.md", removed_chars=removed)
+        return head + "\n" + placeholder + "\n" + tail
@@ -0,0 +1,66 @@
+from dataclasses import dataclass, field
+from typing import Any
+from langchain_core.messages import BaseMessage
+from . import tokens
+
+@dataclass
+class PromptCacheStats:
+    """
+    Tracks how much of each prompt repeats the previous one byte for byte (the part a provider can serve from its prompt cache),
+    and the cached token counts reported by the provider, if any.
+    """
+    tokenizer: str = "cl100k_base"
+    calls: int = 0
+    prompt_tokens: int = 0
+    prefix_tokens: int = 0 # tokens of the prefix shared with the previous call
+    reported_input_tokens: int = 0
+    reported_cached_tokens: int = 0
+    last_fingerprint: list = field(default_factory=list)
+    token_counts: tokens.MessageTokenCounts | None = None # the agent's memoized message counts
+
+    def record_prompt(self, system: str, history: list[BaseMessage], prompt_tokens: int) -> int:
+        # fingerprint of the cacheable prefix, history messages only change by growing or being replaced
+        fingerprint = [("system", hash(system))] + [(id(msg), len(str(msg.content))) for msg in history]
+        shared = 0
+        for previous, current in zip(self.last_fingerprint, fingerprint):
+            if previous != current: break
+            shared += 1
+
+        prefix_tokens = 0
+        if shared:
+            counts = self.token_counts or tokens.MessageTokenCounts(self.tokenizer)
+            prefix_tokens = tokens.get_counter(self.tokenizer)(system) + counts.count_all(history[:shared-1])
+
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.prefix_tokens += prefix_tokens
+        self.last_fingerprint = fingerprint
+        return prefix_tokens
+
+    def record_usage(self, chunk: Any):
+        # providers report cache reads in usage metadata, usually on the last streamed chunk
+        usage = getattr(chunk, "usage_metadata", None) or {}
+        if usage:
+            self.reported_input_tokens += usage.get("input_tokens", 0)
+            self.reported_cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+            return
+        details = ((getattr(chunk, "response_metadata", None) or {}).get("token_usage") or {})
+        if details:
+            self.reported_input_tokens += details.get("prompt_tokens", 0)
+            self.reported_cached_tokens += (details.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+    @property
+    def prefix_hit_rate(self) -> float:
+        return self.prefix_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.reported_cached_tokens / self.reported_input_tokens if self.reported_input_tokens else 0.0
+
+    def __str__(self):
+        result = f"Prompt cache: {self.calls} calls, stable prefix {self.prefix_hit_rate:.0%} of {self.prompt_tokens} prompt tokens"
+        if self.reported_input_tokens:
+            result += f", provider cache hits {self.cache_hit_rate:.0%} of {self.reported_input_tokens} input tokens"
+        if self.token_counts:
+            result += f", message token counts memoized {self.token_counts.hit_rate:.0%}"
+        return result
@@ -1,7 +1,8 @@
-import time
+import time, threading, os, json, re, asyncio
 from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Any, List, Tuple
 from .print_style import PrintStyle
 
 @dataclass
@@ -17,52 +18,203 @@ class RateLimiter:
         self.max_output_tokens = max_output_tokens
         self.window_seconds = window_seconds
         self.call_records: deque = deque()
+        # running totals over call_records, kept in sync on append, popleft and set_output_tokens
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def _locked(self):
+        # guards all state changes, limiters are shared between agents and threads
+        with self.lock:
+            yield
 
     def _clean_old_records(self, current_time: float):
-        while self.call_records and current_time - self.call_records[0].timestamp > self.window_seconds:
-            self.call_records.popleft()
+        while self.call_records and current_time - self.call_records[0].timestamp >= self.window_seconds:
+            record = self.call_records.popleft()
+            self.input_tokens -= record.input_tokens
+            self.output_tokens -= record.output_tokens
 
     def _get_counts(self) -> Tuple[int, int, int]:
-        calls = len(self.call_records)
-        input_tokens = sum(record.input_tokens for record in self.call_records)
-        output_tokens = sum(record.output_tokens for record in self.call_records)
-        return calls, input_tokens, output_tokens
+        return len(self.call_records), self.input_tokens, self.output_tokens
 
-    def _wait_if_needed(self, current_time: float, new_input_tokens: int):
-        while True:
-            self._clean_old_records(current_time)
-            calls, input_tokens, output_tokens = self._get_counts()
-            
-            wait_reasons = []
-            if self.max_calls > 0 and calls >= self.max_calls:
-                wait_reasons.append("max calls")
-            if self.max_input_tokens > 0 and input_tokens + new_input_tokens > self.max_input_tokens:
-                wait_reasons.append("max input tokens")
-            if self.max_output_tokens > 0 and output_tokens >= self.max_output_tokens:
-                wait_reasons.append("max output tokens")
-            
-            if not wait_reasons:
-                break
-            
-            oldest_record = self.call_records[0]
-            wait_time = oldest_record.timestamp + self.window_seconds - current_time
+    def _add_record(self, record: CallRecord):
+        # records stay in time order for _clean_old_records, reservations lie in the future
+        # so a call recorded now may have to go before them, they are few and at the right end
+        index = len(self.call_records)
+        while index > 0 and self.call_records[index - 1].timestamp > record.timestamp:
+            index -= 1
+        self.call_records.insert(index, record)
+        self.input_tokens += record.input_tokens
+        self.output_tokens += record.output_tokens
+
+    def _time_until_freed(self, current_time: float, amount: int, field: str) -> float:
+        # time until enough of the oldest records expire to free the given amount of tokens (or calls)
+        freed = 0
+        for record in self.call_records:
+            freed += getattr(record, field) if field else 1
+            if freed >= amount:
+                return max(0.0, record.timestamp + self.window_seconds - current_time)
+        return max(0.0, self.call_records[-1].timestamp + self.window_seconds - current_time) if self.call_records else 0.0
+
+    def get_wait_time(self, new_input_tokens: int, current_time: float | None = None) -> Tuple[float, List[str]]:
+        """
+        Return how long a call with the given input tokens has to wait to fit the limits, and why.
+        Does not sleep and does not record the call.
+        """
+        with self._locked():
+            return self._get_wait_time(new_input_tokens, current_time)
+
+    def _get_wait_time(self, new_input_tokens: int, current_time: float | None = None) -> Tuple[float, List[str]]:
+        current_time = time.time() if current_time is None else current_time
+        self._clean_old_records(current_time)
+        calls, input_tokens, output_tokens = self._get_counts()
+
+        wait_time = 0.0
+        wait_reasons = []
+        if self.max_calls > 0 and calls >= self.max_calls:
+            wait_reasons.append("max calls")
+            wait_time = max(wait_time, self._time_until_freed(current_time, calls - self.max_calls + 1, ""))
+        if self.max_input_tokens > 0 and input_tokens + new_input_tokens > self.max_input_tokens:
+            wait_reasons.append("max input tokens")
+            # a call larger than the whole limit only waits for the window to empty
+            excess = min(input_tokens + new_input_tokens - self.max_input_tokens, input_tokens)
+            wait_time = max(wait_time, self._time_until_freed(current_time, excess, "input_tokens"))
+        if self.max_output_tokens > 0 and output_tokens >= self.max_output_tokens:
+            wait_reasons.append("max output tokens")
+            wait_time = max(wait_time, self._time_until_freed(current_time, output_tokens - self.max_output_tokens + 1, "output_tokens"))
+
+        return wait_time, wait_reasons
+
+    def _acquire(self, input_token_count: int) -> Tuple[CallRecord | None, float, List[str]]:
+        with self._locked():
+            wait_time, wait_reasons = self._get_wait_time(input_token_count)
             if wait_time > 0:
-                PrintStyle(font_color="yellow", padding=True).print(f"Rate limit exceeded. Waiting for {wait_time:.2f} seconds due to: {', '.join(wait_reasons)}")
-                time.sleep(wait_time)
-            current_time = time.time()
+                return None, wait_time, wait_reasons
+            new_record = CallRecord(time.time(), input_token_count)
+            self._add_record(new_record)
+            return new_record, 0.0, wait_reasons
 
     def limit_call_and_input(self, input_token_count: int) -> CallRecord:
-        current_time = time.time()
-        self._wait_if_needed(current_time, input_token_count)
-        new_record = CallRecord(current_time, input_token_count)
-        self.call_records.append(new_record)
-        return new_record
-
-    def set_output_tokens(self, output_token_count: int):
-        if self.call_records:
-            self.call_records[-1].output_tokens += output_token_count
+        while True:
+            record, wait_time, wait_reasons = self._acquire(input_token_count)
+            if record: return record
+            # sleep outside of the lock so other agents can still record their output tokens
+            PrintStyle(font_color="yellow", padding=True).print(f"Rate limit exceeded. Waiting for {wait_time:.2f} seconds due to: {', '.join(wait_reasons)}")
+            time.sleep(wait_time)
+
+    async def alimit_call_and_input(self, input_token_count: int) -> CallRecord:
+        while True:
+            record, wait_time, wait_reasons = self._acquire(input_token_count)
+            if record: return record
+            PrintStyle(font_color="yellow", padding=True).print(f"Rate limit exceeded. Waiting for {wait_time:.2f} seconds due to: {', '.join(wait_reasons)}")
+            await asyncio.sleep(wait_time)
+
+    def try_acquire(self, input_token_count: int) -> float:
+        """
+        Non-blocking variant of limit_call_and_input.
+        Records the call and returns 0 if it fits the limits, otherwise returns the time to wait before trying again.
+        """
+        _, wait_time, _ = self._acquire(input_token_count)
+        return wait_time
+
+    def reserve(self, input_token_count: int) -> float:
+        """
+        Book the call at the earliest time it fits the limits and return the delay until then.
+        The caller is expected to wait the returned time before making the call.
+        """
+        with self._locked():
+            current_time = time.time()
+            wait_time, _ = self._get_wait_time(input_token_count, current_time)
+            self._add_record(CallRecord(current_time + wait_time, input_token_count))
+            return wait_time
+
+    def set_output_tokens(self, output_token_count: int, record: CallRecord | None = None):
+        # output tokens belong to the given call record, or to the latest call when not specified
+        with self._locked():
+            target = self._find_record(record) if record else self._latest_record(time.time())
+            if target:
+                target.output_tokens += output_token_count
+                self.output_tokens += output_token_count
         return self
 
+    def _latest_record(self, current_time: float) -> CallRecord | None:
+        # latest call already made, reservations still in the future are skipped
+        for existing in reversed(self.call_records):
+            if existing.timestamp <= current_time:
+                return existing
+        return None
+
+    def _find_record(self, record: CallRecord) -> CallRecord | None:
+        for existing in reversed(self.call_records):
+            if existing is record or (existing.timestamp == record.timestamp and existing.input_tokens == record.input_tokens):
+                return existing
+        return None # record already left the window
+
+
+class FileRateLimiter(RateLimiter):
+    # window state is kept in a json file guarded by a file lock, so separate processes share one budget
+
+    def __init__(self, path: str, max_calls: int, max_input_tokens: int, max_output_tokens: int, window_seconds: int = 60):
+        super().__init__(max_calls, max_input_tokens, max_output_tokens, window_seconds)
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        import fcntl
+        with self.lock, open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+                self._save()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                try: records = json.load(f)
+                except json.JSONDecodeError: records = []
+        self.call_records = deque(sorted((CallRecord(*record) for record in records), key=lambda record: record.timestamp))
+        self.input_tokens = sum(record.input_tokens for record in self.call_records)
+        self.output_tokens = sum(record.output_tokens for record in self.call_records)
+
+    def _save(self):
+        self._clean_old_records(time.time())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([[r.timestamp, r.input_tokens, r.output_tokens] for r in self.call_records], f)
+        os.replace(tmp_path, self.path)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(key: str, max_calls: int, max_input_tokens: int, max_output_tokens: int, window_seconds: int = 60, shared_dir: str = "") -> RateLimiter:
+    """
+    Return the process-wide rate limiter for the given key (see model_key), creating it on first use.
+    Limits are taken from the first caller. With shared_dir set, the limiter state is shared with other processes through a file.
+    """
+    with _limiters_lock:
+        if key not in _limiters:
+            if shared_dir and os.name != "nt": # file locking relies on fcntl
+                path = os.path.join(shared_dir, re.sub(r"[^\w.-]", "_", key) + ".json")
+                _limiters[key] = FileRateLimiter(path, max_calls, max_input_tokens, max_output_tokens, window_seconds)
+            else:
+                _limiters[key] = RateLimiter(max_calls, max_input_tokens, max_output_tokens, window_seconds)
+        return _limiters[key]
+
+def model_key(model: Any) -> str:
+    # models of the same class and model/deployment name share one provider quota
+    for attr in ("model_name", "deployment_name", "model"):
+        name = getattr(model, attr, None)
+        if isinstance(name, str) and name:
+            return f"{type(model).__name__}:{name}"
+    return f"{type(model).__name__}:{id(model)}"
+
 # Example usage
 rate_limiter = RateLimiter(max_calls=5, max_input_tokens=1000, max_output_tokens=2000)
 
@@ -0,0 +1,70 @@
+import re, selectors, time
+
+# ANSI escape sequences and the carriage return of \r\n line ends, removed in one pass
+cleanup_pattern = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])|\r(?=\n)')
+
+def clean_output(text: str) -> str:
+    return cleanup_pattern.sub('', text)
+
+
+class SentinelScanner:
+    """
+    Finds the end-of-command line in streamed output without rescanning what was already seen.
+    Output is released as soon as it can no longer be the start of the end line,
+    so only a partial last line that still matches the sentinel is held back.
+    """
+
+    def __init__(self, sentinel: bytes, pattern: re.Pattern[bytes]):
+        self.sentinel = sentinel # what the end line starts with after its newline
+        self.pattern = pattern # the complete end line, including the newline before it
+        self.pending = bytearray()
+        self.match: re.Match[bytes] | None = None
+
+    def feed(self, data: bytes) -> bytes:
+        # output that is safe to release, match is set once the end line is complete
+        self.pending += data
+        if self.pattern.search(self.pending):
+            end = bytes(self.pending) # the match must not point into the buffer that is cleared
+            self.match = self.pattern.search(end)
+            self.pending.clear()
+            return end[:self.match.start()] # type: ignore
+        start = self.pending.rfind(b"\n")
+        if start == -1 or not self.sentinel.startswith(bytes(self.pending[start + 1:start + 1 + len(self.sentinel)])):
+            start = len(self.pending) - 1 if self.pending.endswith(b"\r") else len(self.pending)
+        elif start > 0 and self.pending[start - 1] == ord("\r"):
+            start -= 1
+        released = bytes(self.pending[:start])
+        del self.pending[:start]
+        return released
+
+    def flush(self) -> bytes:
+        # held back output, when the stream ended without the end line
+        released = bytes(self.pending)
+        self.pending.clear()
+        return released
+
+
+class SelectorReader:
+    """
+    Reads a file descriptor as soon as it has data, waiting in the selector until then or until the deadline.
+    """
+
+    def __init__(self, fd: int, read, chunk_size: int = 65536):
+        self.read = read
+        self.chunk_size = chunk_size
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(fd, selectors.EVENT_READ)
+
+    def read_chunk(self, deadline: float | None) -> bytes | None:
+        # next available output, None at end of stream, raises TimeoutError past the deadline (time.monotonic)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0: raise TimeoutError()
+        if not self.selector.select(remaining): raise TimeoutError()
+        try:
+            data = self.read(self.chunk_size)
+        except OSError:
+            return None # EIO on a pty whose process exited
+        return data or None
+
+    def close(self):
+        self.selector.close()
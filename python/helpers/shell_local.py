@@ -1,68 +1,59 @@
-# import select
-# import subprocess
-# import time
-# import sys
-# from typing import Optional, Tuple
+import os
+import pty
+import subprocess
+from python.helpers.shell_io import SelectorReader
+from python.helpers.shell_session import InteractiveSession
 
-# class LocalInteractiveSession:
-#     def __init__(self):
-#         self.process = None
-#         self.full_output = ''
 
-#     def connect(self):
-#         # Start a new subprocess with the appropriate shell for the OS
-#         if sys.platform.startswith('win'):
-#             # Windows
-#             self.process = subprocess.Popen(
-#                 ['cmd.exe'],
-#                 stdin=subprocess.PIPE,
-#                 stdout=subprocess.PIPE,
-#                 stderr=subprocess.PIPE,
-#                 text=True,
-#                 bufsize=1
-#             )
-#         else:
-#             # macOS and Linux
-#             self.process = subprocess.Popen(
-#                 ['/bin/bash'],
-#                 stdin=subprocess.PIPE,
-#                 stdout=subprocess.PIPE,
-#                 stderr=subprocess.PIPE,
-#                 text=True,
-#                 bufsize=1
-#             )
+class LocalInteractiveSession(InteractiveSession):
+    """
+    Bash on a local pseudo terminal, for hosts where docker is unavailable.
+    Code runs directly on the host, without any sandbox.
+    """
 
-#     def close(self):
-#         if self.process:
-#             self.process.terminate()
-#             self.process.wait()
+    def __init__(self, shell: str = "/bin/bash", cwd: str | None = None):
+        self.shell = shell
+        self.cwd = cwd
+        self.process = None
+        self.fd = None
+        self.reader = None
 
-#     def send_command(self, command: str):
-#         if not self.process:
-#             raise Exception("Shell not connected")
-#         self.full_output = ""
-#         self.process.stdin.write(command + '\n') # type: ignore
-#         self.process.stdin.flush() # type: ignore
- 
-#     def read_output(self) -> Tuple[str, Optional[str]]:
-#         if not self.process:
-#             raise Exception("Shell not connected")
+    def connect(self):
+        master, slave = pty.openpty()
+        self.process = subprocess.Popen(
+            [self.shell, "--noprofile", "--norc"],
+            stdin=slave,
+            stdout=slave,
+            stderr=slave,
+            cwd=self.cwd,
+            env={**os.environ, "TERM": "dumb"},
+            start_new_session=True, # the shell owns the terminal, ctrl+c reaches its foreground job
+        )
+        os.close(slave)
+        self.fd = master
+        self.reader = SelectorReader(master, lambda size: os.read(master, size))
+        # no prompt and no echo of the input, then wait for the shell to settle
+        self._write(b"stty -echo; PS1=''; PS2=''\n")
+        self.run("true", timeout=10)
 
-#         partial_output = ''
-#         while True:
-#             rlist, _, _ = select.select([self.process.stdout], [], [], 0.1)
-#             if rlist:
-#                 line = self.process.stdout.readline()  # type: ignore
-#                 if line:
-#                     partial_output += line
-#                     self.full_output += line
-#                     time.sleep(0.1)
-#                 else:
-#                     break  # No more output
-#             else:
-#                 break  # No data available
+    def close(self):
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
-#         if not partial_output:
-#             return self.full_output, None
-        
-#         return self.full_output, partial_output
\ No newline at end of file
+    def _write(self, data: bytes):
+        if self.fd is None:
+            raise Exception("Shell not connected")
+        os.write(self.fd, data)
+
+    def _read(self, deadline):
+        if not self.reader:
+            raise Exception("Shell not connected")
+        return self.reader.read_chunk(deadline)
@@ -0,0 +1,80 @@
+import codecs, re, time, uuid
+from abc import ABC, abstractmethod
+from typing import Callable
+from python.helpers.files import read_file
+from python.helpers.messages import BoundedOutput
+from python.helpers.shell_io import SentinelScanner, clean_output
+
+
+class InteractiveSession(ABC):
+    """
+    Persistent shell on a terminal, local or remote. Working directory, environment and
+    background jobs stay between commands. Each command is followed by a printf of an
+    end marker with the exit code, output is read until the marker shows up.
+    """
+
+    # printed from two arguments, so the marker never appears in echoed input
+    end_prefix = "@@==>>"
+
+    @abstractmethod
+    def connect(self):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def _write(self, data: bytes):
+        pass
+
+    @abstractmethod
+    def _read(self, deadline: float | None) -> bytes | None:
+        # next available output, None when the shell ended, raises TimeoutError past the deadline (time.monotonic)
+        pass
+
+    def _send_marker(self, marker: str):
+        self._write(f"printf '\\n%s%s %s\\n' '{self.end_prefix}' '{marker}' \"$?\"\n".encode())
+
+    def run(self, command: str, timeout: int = 0, max_output_bytes: int = 0, on_output: Callable[[str], None] | None = None) -> str:
+        marker = uuid.uuid4().hex
+        self._write((command + "\n").encode())
+        self._send_marker(marker)
+        end_line = (self.end_prefix + marker).encode()
+        scanner = SentinelScanner(end_line, re.compile(rb"\r?\n" + re.escape(end_line) + rb" (\d+)\r?\n"))
+        output = BoundedOutput(max_output_bytes)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        timed_out = False
+
+        def emit(data: bytes):
+            output.append(data)
+            if on_output and data: on_output(decoder.decode(data))
+
+        while True:
+            try:
+                data = self._read(deadline)
+            except TimeoutError:
+                if timed_out: # did not recover from the interrupt, start over with a new shell
+                    emit(scanner.flush())
+                    self.close()
+                    self.connect()
+                    return clean_output(output.text()) + "\n" + read_file("./prompts/fw.code_timeout.md", seconds=timeout)
+                # interrupt the command, the queued marker is flushed with the input so it is sent again
+                timed_out = True
+                self._write(b"\x03")
+                self._send_marker(marker)
+                deadline = time.monotonic() + 5
+                continue
+            if data is None:
+                emit(scanner.flush())
+                self.close()
+                self.connect()
+                return clean_output(output.text())
+            emit(scanner.feed(data))
+            if scanner.match:
+                text = clean_output(output.text())
+                exit_code = int(scanner.match.group(1))
+                if timed_out: return text + "\n" + read_file("./prompts/fw.code_timeout.md", seconds=timeout)
+                if exit_code == 0: return text if text else "Command executed successfully, but produced no output."
+                return f"Error (exit code {exit_code}): {text if text else 'Unknown error occurred'}"
@@ -0,0 +1,72 @@
+from functools import lru_cache
+from typing import Callable
+from langchain_core.messages import BaseMessage
+from .print_style import PrintStyle
+
+APPROXIMATE = "approximate"
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4 # role and separator tokens added per chat message
+
+_counters: dict[str, Callable[[str], int]] = {}
+
+def approximate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN)
+
+def register_counter(name: str, counter: Callable[[str], int]):
+    # plug in a custom tokenizer, select it by AgentConfig.tokenizer = name
+    _counters[name] = lru_cache(maxsize=256)(counter)
+
+def get_counter(name: str = "cl100k_base") -> Callable[[str], int]:
+    if name not in _counters:
+        register_counter(name, _load_tokenizer(name))
+    return _counters[name]
+
+def _load_tokenizer(name: str) -> Callable[[str], int]:
+    if not name or name == APPROXIMATE: return approximate_tokens
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(name)
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        PrintStyle.hint(f"Tokenizer '{name}' not available ({e}), falling back to approximate token counts.")
+        return approximate_tokens
+
+class MessageTokenCounts:
+    """
+    Token counts of one agent's history messages, kept out of band as message metadata is sent to the provider
+    and langchain messages do not support weak references. Entries are keyed by id() and hold their message,
+    so an id is not reused while cached, prune drops the messages no longer in history.
+    History messages only grow by appending, so only the newly appended part of a content is counted.
+    """
+
+    def __init__(self, counter_name: str = "cl100k_base"):
+        self.counter_name = counter_name
+        self.entries: dict[int, tuple[BaseMessage, int, int]] = {} # id -> (message, counted chars, tokens)
+        self.hits = 0 # counts served from the cache, fully or by counting only appended content
+        self.misses = 0
+
+    def count(self, message: BaseMessage) -> int:
+        counter = get_counter(self.counter_name)
+        content = str(message.content)
+        entry = self.entries.get(id(message))
+        if entry and entry[0] is message and entry[1] <= len(content):
+            _, chars, count = entry
+            if chars < len(content): count += counter(content[chars:])
+            self.hits += 1
+        else:
+            count = counter(content) + MESSAGE_OVERHEAD
+            self.misses += 1
+        self.entries[id(message)] = (message, len(content), count)
+        return count
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def count_all(self, messages: list[BaseMessage]) -> int:
+        return sum(self.count(message) for message in messages)
+
+    def prune(self, messages: list[BaseMessage]):
+        # keep the counts of the given messages only, called when history is replaced
+        keep = {id(message) for message in messages}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keep}
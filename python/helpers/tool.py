@@ -1,3 +1,4 @@
+import asyncio
 from abc import abstractmethod
 from typing import TypedDict
 from agent import Agent
@@ -21,6 +22,14 @@ class Tool:
     def execute(self,**kwargs) -> Response:
         pass
 
+    async def aexecute(self, **kwargs) -> Response:
+        # blocking tools run in a worker thread, tools with native async support override this
+        return await asyncio.to_thread(self.execute, **kwargs)
+
+    async def abefore_execution(self, **kwargs):
+        # the sync hook waits while the agent is paused, run it in a worker thread so other agents keep going
+        await asyncio.to_thread(self.before_execution, **kwargs)
+
     def before_execution(self, **kwargs):
         if self.agent.handle_intervention(): return # wait for intervention and handle it, if paused
         PrintStyle(font_color="#1B4F72", padding=True, background_color="white", bold=True).print(f"{self.agent.agent_name}: Using tool '{self.name}':")
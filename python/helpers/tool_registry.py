@@ -0,0 +1,87 @@
+import importlib, inspect, os, threading
+from . import files
+
+TOOLS_DIR = "python/tools"
+TOOLS_PACKAGE = "python.tools"
+
+_lock = threading.RLock()
+_tools: dict[str, type | None] = {} # tool name -> Tool subclass, None for a module without one
+_mtimes: dict[str, int] = {} # tool name -> mtime of its module when loaded
+_registered: set[str] = set() # explicitly registered tools, not backed by a module file
+_names: list[str] | None = None # discovered tool module names
+
+def register(name: str, tool_class: type):
+    # register a tool class under a name, takes precedence over python/tools modules
+    with _lock:
+        _tools[name] = tool_class
+        _registered.add(name)
+
+def unregister(name: str):
+    with _lock:
+        _tools.pop(name, None)
+        _mtimes.pop(name, None)
+        _registered.discard(name)
+
+def discover(load: bool = False) -> list[str]:
+    # scan python/tools once, classes are loaded on first use unless load is set
+    global _names
+    with _lock:
+        tools_dir = files.get_abs_path(TOOLS_DIR)
+        _names = sorted(file[:-3] for file in os.listdir(tools_dir) if file.endswith(".py") and not file.startswith("_"))
+        if load:
+            for name in _names: get(name)
+        return names()
+
+def names() -> list[str]:
+    # names of all available tools
+    with _lock:
+        if _names is None: discover()
+        return sorted(set(_names or []) | _registered)
+
+def get(name: str, hot_reload: bool = False) -> type | None:
+    """
+    Return the Tool subclass for the given tool name, or None if there is no such tool.
+    With hot_reload, the tool module is reloaded when its file has changed since it was loaded,
+    and python/tools is scanned again for a tool added after discovery.
+    """
+    with _lock:
+        if name in _registered:
+            return _tools[name]
+        if name not in names() and hot_reload:
+            discover()
+        if name not in names():
+            return None
+
+        if name in _tools and not hot_reload:
+            return _tools[name]
+
+        path = files.get_abs_path(TOOLS_DIR, f"{name}.py")
+        if not os.path.exists(path):
+            unregister(name)
+            discover()
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        if name not in _tools or _mtimes.get(name) != mtime:
+            _tools[name] = _load(name, reload=name in _tools)
+            _mtimes[name] = mtime
+        return _tools[name]
+
+def reload():
+    # forget all discovered tools, they are loaded again on next use
+    global _names
+    with _lock:
+        for name in list(_tools):
+            if name not in _registered: _tools.pop(name)
+        _mtimes.clear()
+        _names = None
+
+def _load(name: str, reload: bool = False) -> type | None:
+    from python.helpers.tool import Tool
+
+    module = importlib.import_module(f"{TOOLS_PACKAGE}.{name}")  # Import the module
+    if reload: module = importlib.reload(module)
+
+    # prefer tool classes defined in the module itself over imported ones
+    class_list = [cls for _, cls in inspect.getmembers(module, inspect.isclass) if cls is not Tool and issubclass(cls, Tool)]
+    own = [cls for cls in class_list if cls.__module__ == module.__name__]
+    return (own or class_list or [None])[0] # no tool class, the caller falls back to Unknown
@@ -1,15 +1,73 @@
 from langchain.storage import InMemoryByteStore, LocalFileStore
 from langchain.embeddings import CacheBackedEmbeddings
-from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
 
 from . import files
+from .vector_index import VectorIndex, create_index, relevance_scores, CHROMA
 from langchain_core.documents import Document
-import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable
+import uuid, hashlib, json, threading
+import numpy as np
+
+
+class QueryCachedEmbeddings(Embeddings):
+    # CacheBackedEmbeddings only caches documents, this adds a cache for query embeddings
+    # keyed by content hash, kept in memory (LRU) and persisted in the same byte store and namespace
+    # persisted entries are bounded by the same LRU, an evicted query is deleted from the store as well
+
+    def __init__(self, embedder: Embeddings, underlying: Embeddings, store: ByteStore, namespace: str, max_items: int = 1000):
+        self.embedder = embedder
+        self.underlying = underlying
+        self.store = store
+        self.namespace = namespace
+        self.prefix = namespace + "query-"
+        self.max_items = max_items
+        self.cache: OrderedDict[str, list[float] | None] = OrderedDict() # None for persisted vectors not loaded yet
+        self.lock = threading.Lock()
+        # queries persisted by earlier runs, the store only filters keys by directory so all keys are listed
+        for key in self.store.yield_keys():
+            if key.startswith(self.prefix): self.cache[key] = None
+        self._evict()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.prefix + hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self.lock:
+            vector = self.cache.get(key)
+            if key in self.cache: self.cache.move_to_end(key)
+        if vector is not None:
+            return vector
+
+        stored = self.store.mget([key])[0]
+        if stored:
+            vector = json.loads(stored)
+        else:
+            vector = self.underlying.embed_query(text)
+            self.store.mset([(key, json.dumps(vector).encode())])
+
+        with self.lock:
+            self.cache[key] = vector
+            self.cache.move_to_end(key)
+        self._evict()
+        return vector
+
+    def _evict(self):
+        with self.lock:
+            evicted = []
+            while len(self.cache) > self.max_items:
+                evicted.append(self.cache.popitem(last=False)[0])
+        if evicted: self.store.mdelete(evicted)
 
 
 class VectorDB:
 
-    def __init__(self, embeddings_model, in_memory=False, cache_dir="./cache"):
+    def __init__(self, embeddings_model, in_memory=False, cache_dir="./cache", query_cache_size=1000, backend=CHROMA):
         print("Initializing VectorDB...")
         self.embeddings_model = embeddings_model
 
@@ -23,62 +81,134 @@ class VectorDB:
 
 
         #here we setup the embeddings model with the chosen cache storage
-        self.embedder = CacheBackedEmbeddings.from_bytes_store(
-            embeddings_model, 
-            self.store, 
-            namespace=getattr(embeddings_model, 'model', getattr(embeddings_model, 'model_name', "default")) )
-
-
-        self.db = Chroma(embedding_function=self.embedder,persist_directory=db_cache)
+        namespace = getattr(embeddings_model, 'model', getattr(embeddings_model, 'model_name', "default"))
+        self.embedder = QueryCachedEmbeddings(
+            CacheBackedEmbeddings.from_bytes_store(embeddings_model, self.store, namespace=namespace),
+            embeddings_model,
+            self.store,
+            namespace=namespace,
+            max_items=query_cache_size)
+
+        # vector storage and search backend: chroma, numpy or hnsw
+        self.index: VectorIndex = create_index(backend, db_cache)
+        self.lock = threading.RLock() # serializes writes, one store can be shared by many agents
+
+    def close(self):
+        # backends persist on every write, closing releases their files and clients, the instance is not used after this
+        with self.lock:
+            self.embedder.cache.clear()
+            self.index.close()
         
         
     def search_similarity(self, query, results=3):
-        return self.db.similarity_search(query,results)
+        return [doc for doc, _ in self.search_similarity_threshold_with_scores(query, results, None)]
     
     def search_similarity_threshold(self, query, results=3, threshold=0.5):
-        return self.db.search(query, search_type="similarity_score_threshold", k=results, score_threshold=threshold)
+        return [doc for doc, _ in self.search_similarity_threshold_with_scores(query, results, threshold)]
+
+    def search_similarity_threshold_with_scores(self, query, results=3, threshold: float | None = 0.5) -> list[tuple[Document, float]]:
+        return self.index.search(self.embedder.embed_query(query), results, threshold)
 
     def search_max_rel(self, query, results=3):
-        return self.db.max_marginal_relevance_search(query,results)
-
-    def delete_documents_by_query(self, query:str, threshold=0.1):
-        k = 100
-        tot = 0
-        while True:
-            # Perform similarity search with score
-            docs = self.search_similarity_threshold(query, results=k, threshold=threshold)
-
-            # Extract document IDs and filter based on score
-            # document_ids = [result[0].metadata["id"] for result in docs if result[1] < score_limit]
-            document_ids = [result.metadata["id"] for result in docs]
-            
-
-            # Delete documents with IDs over the threshold score
-            if document_ids:
-                # fnd = self.db.get(where={"id": {"$in": document_ids}})
-                # if fnd["ids"]: self.db.delete(ids=fnd["ids"])
-                # tot += len(fnd["ids"])
-                self.db.delete(ids=document_ids)
-                tot += len(document_ids)
-                                    
-            # If fewer than K document IDs, break the loop
-            if len(document_ids) < k:
-                break
-        
-        return tot
+        return self.index.mmr_search(self.embedder.embed_query(query), results)
+
+    def delete_documents_by_query(self, query:str, threshold=0.1, dry_run=False):
+        # the query is embedded once and all matches are deleted in one batch, dry_run only counts them
+        embedding = self.embedder.embed_query(query)
+        with self.lock:
+            document_ids = [doc.metadata["id"] for doc, _ in self.index.search_all(embedding, threshold)]
+            if dry_run or not document_ids:
+                return len(document_ids)
+            return self.index.delete(document_ids)
 
     def delete_documents_by_ids(self, ids:list[str]):
-        # pre = self.db.get(ids=ids)["ids"]
-        self.db.delete(ids=ids)
-        # post = self.db.get(ids=ids)["ids"]
-        #TODO? compare pre and post
-        return len(ids)
-        
-    def insert_document(self, data):
-        id = str(uuid.uuid4())
-        self.db.add_documents(documents=[ Document(data, metadata={"id": id}) ], ids=[id])
+        with self.lock:
+            return self.index.delete(ids)
         
-        return id
-        
-
-
+    def insert_document(self, data, dedupe_threshold: float = 0):
+        return self.insert_documents([data], dedupe_threshold=dedupe_threshold)[0]
+
+    def insert_documents(self, texts: list[str], metadatas: list[dict] | None = None, dedupe_threshold: float = 0) -> list[str]:
+        return self._insert(texts, metadatas, dedupe_threshold)[0]
+
+    def _insert(self, texts: list[str], metadatas: list[dict] | None, dedupe_threshold: float) -> tuple[list[str], int]:
+        # one embedding request and one index write for the whole batch
+        # returns the id of every text and the number of stored documents replaced by near duplicates
+        embeddings = self.embedder.embed_documents(texts)
+        with self.lock:
+            ids = [str(uuid.uuid4()) for _ in texts]
+            replaced = set()
+            if dedupe_threshold > 0:
+                vectors = np.asarray(embeddings, dtype=np.float32)
+                norms = np.einsum("ij,ij->i", vectors, vectors)
+                for i, embedding in enumerate(embeddings):
+                    # a near duplicate of an earlier text in the batch shares its id, the later text is kept
+                    if i:
+                        scores = relevance_scores(norms[:i] + norms[i] - 2 * (vectors[:i] @ vectors[i]))
+                        best = int(np.argmax(scores))
+                        if scores[best] >= dedupe_threshold:
+                            ids[i] = ids[best]
+                            continue
+                    # a near duplicate of a stored memory replaces it under the same id instead of adding a new one
+                    match = self.index.search(embedding, 1, dedupe_threshold)
+                    if match:
+                        ids[i] = match[0][0].metadata["id"]
+                        replaced.add(ids[i])
+            rows = sorted({id: i for i, id in enumerate(ids)}.values()) # last text of each id
+            self.index.add([ids[i] for i in rows], [texts[i] for i in rows], [embeddings[i] for i in rows],
+                           [{**(metadatas[i] if metadatas else {}), "id": ids[i]} for i in rows])
+        return ids, len(replaced)
+
+    def ingest(self, texts: Iterable[str], batch_size=64, workers=4, dedupe_threshold: float = 0) -> dict:
+        """
+        Bulk insert a stream of texts in batches.
+        Embeddings of the next batches are requested concurrently and land in the embeddings cache,
+        each batch is then written with a single insert that reads its embeddings from the cache.
+        Returns the number of new memories and of stored memories replaced by near duplicates.
+        """
+        ids = set()
+        replaced = 0
+        iterator = iter(texts)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if batch:
+                    pending.append((batch, executor.submit(self.embedder.embed_documents, batch)))
+                if pending and (len(pending) >= workers or not batch):
+                    done_batch, embedding = pending.popleft()
+                    embedding.result()
+                    batch_ids, batch_replaced = self._insert(done_batch, None, dedupe_threshold)
+                    # an id written by an earlier batch of this ingest is an update of a new memory, not a replacement
+                    replaced += batch_replaced - len(ids & set(batch_ids))
+                    ids.update(batch_ids)
+                if not batch and not pending:
+                    return {"inserted": len(ids) - replaced, "replaced": replaced}
+
+    def compact(self, threshold=0.9, dry_run=False) -> dict:
+        """
+        Merge redundant memories. Documents are clustered greedily, every document not yet
+        in a cluster collects all remaining ones scoring above the threshold against it.
+        The longest text of each cluster is kept and the rest are deleted.
+        Returns collection size before and after and the number of merged clusters.
+        """
+        with self.lock:
+            docs, vectors = self.index.entries()
+            norms = np.einsum("ij,ij->i", vectors, vectors) if len(docs) else np.zeros(0)
+            remaining = np.ones(len(docs), dtype=bool)
+            remove: list[str] = []
+            clusters = 0
+            for i in range(len(docs)):
+                if not remaining[i]: continue
+                # same relevance scale as search, one row at a time to keep memory linear
+                scores = relevance_scores(norms + norms[i] - 2 * (vectors @ vectors[i]))
+                members = np.nonzero(remaining & (scores >= threshold))[0]
+                remaining[members] = False
+                if len(members) < 2: continue
+                clusters += 1
+                keep = max(members, key=lambda m: len(docs[m].page_content))
+                remove += [docs[m].metadata["id"] for m in members if m != keep]
+
+            if remove and not dry_run:
+                self.index.delete(remove)
+            return {"before": len(docs), "after": len(docs) - len(remove), "merged_clusters": clusters, "removed": len(remove)}
@@ -0,0 +1,440 @@
+import json, math, os, threading
+from abc import ABC, abstractmethod
+import numpy as np
+from langchain_core.documents import Document
+
+CHROMA = "chroma"
+NUMPY = "numpy"
+HNSW = "hnsw"
+
+
+def relevance_scores(distances: np.ndarray) -> np.ndarray:
+    # same scale as the langchain chroma relevance scores for squared l2 distances, so thresholds work across backends
+    return 1.0 - distances / math.sqrt(2)
+
+def maximal_marginal_relevance(query: np.ndarray, embeddings: np.ndarray, k: int, lambda_mult: float = 0.5) -> list[int]:
+    # pick results relevant to the query but different from each other, returns row indices into embeddings
+    if len(embeddings) == 0 or k <= 0: return []
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-10)
+    query_similarity = normalized @ (query / max(float(np.linalg.norm(query)), 1e-10))
+    selected = [int(np.argmax(query_similarity))]
+    while len(selected) < min(k, len(embeddings)):
+        redundancy = np.max(normalized @ normalized[selected].T, axis=1)
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+class VectorIndex(ABC):
+    """
+    Storage and search of embedded documents, VectorDB takes care of embedding and caching.
+    Scores are relevance scores where 1 is an exact match.
+    """
+
+    @abstractmethod
+    def add(self, ids: list[str], texts: list[str], embeddings: list[list[float]], metadatas: list[dict]):
+        pass
+
+    @abstractmethod
+    def search(self, embedding: list[float], k: int, threshold: float | None = None) -> list[tuple[Document, float]]:
+        pass
+
+    @abstractmethod
+    def mmr_search(self, embedding: list[float], k: int, fetch_k: int = 20, lambda_mult: float = 0.5) -> list[Document]:
+        pass
+
+    @abstractmethod
+    def delete(self, ids: list[str]) -> int:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def entries(self) -> tuple[list[Document], np.ndarray]:
+        # all stored documents and their embeddings as rows of a matrix, used by offline jobs like compaction
+        pass
+
+    def close(self):
+        # release files and clients, the index is not used after this
+        pass
+
+    def search_all(self, embedding: list[float], threshold: float, page_size: int = 100) -> list[tuple[Document, float]]:
+        # all documents above the threshold, results come sorted by score so the page grows until one falls below
+        k = page_size
+        while True:
+            results = self.search(embedding, k)
+            matched = [result for result in results if result[1] >= threshold]
+            if len(matched) < len(results) or k >= self.count():
+                return matched
+            k *= 4
+
+
+class ChromaIndex(VectorIndex):
+
+    def __init__(self, persist_directory: str, collection_name: str = "langchain"):
+        import chromadb
+        # same collection the langchain Chroma wrapper uses, existing memories stay available
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.collection = self.client.get_or_create_collection(collection_name)
+
+    def add(self, ids, texts, embeddings, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas) # type: ignore
+
+    def _query(self, embedding, k, include):
+        if k <= 0 or self.count() == 0: return None
+        return self.collection.query(query_embeddings=[embedding], n_results=min(k, self.count()), include=include)
+
+    def search(self, embedding, k, threshold=None):
+        res = self._query(embedding, k, ["documents", "metadatas", "distances"])
+        if not res: return []
+        scores = relevance_scores(np.array(res["distances"][0])) # type: ignore
+        results = [(Document(text or "", metadata=metadata or {}), float(score))
+                   for text, metadata, score in zip(res["documents"][0], res["metadatas"][0], scores)] # type: ignore
+        return [result for result in results if threshold is None or result[1] >= threshold]
+
+    def mmr_search(self, embedding, k, fetch_k=20, lambda_mult=0.5):
+        res = self._query(embedding, fetch_k, ["documents", "metadatas", "embeddings"])
+        if not res: return []
+        selected = maximal_marginal_relevance(np.array(embedding), np.array(res["embeddings"][0]), k, lambda_mult) # type: ignore
+        return [Document(res["documents"][0][i] or "", metadata=res["metadatas"][0][i] or {}) for i in selected] # type: ignore
+
+    def delete(self, ids):
+        if ids: self.collection.delete(ids=ids)
+        return len(ids)
+
+    def count(self):
+        return self.collection.count()
+
+    def close(self):
+        # chroma keeps one system per path cached for the whole process, it is stopped and dropped so its files are released
+        from chromadb.api.client import SharedSystemClient
+        self.client._system.stop()
+        SharedSystemClient._identifer_to_system.pop(self.client._identifier, None) # sic, chroma's spelling
+
+    def entries(self):
+        res = self.collection.get(include=["documents", "metadatas", "embeddings"]) # type: ignore
+        docs = [Document(text or "", metadata=metadata or {}) for text, metadata in zip(res["documents"], res["metadatas"])] # type: ignore
+        return docs, np.asarray(res["embeddings"] if docs else np.zeros((0, 0)), dtype=np.float32) # type: ignore
+
+
+class DocumentStore:
+    # documents of the in-process indexes, an append-only jsonl file rewritten only on delete
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids: list[str] = []
+        self.texts: list[str] = []
+        self.metadatas: list[dict] = []
+        damaged = False
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if not line.strip(): continue
+                    try:
+                        doc = json.loads(line)
+                    except json.JSONDecodeError:
+                        damaged = True # last line of an append interrupted by a crash, the documents before it are intact
+                        break
+                    self.ids.append(doc["id"])
+                    self.texts.append(doc["text"])
+                    self.metadatas.append(doc["metadata"])
+        if damaged: self.keep(list(range(len(self.ids))))
+
+    def append(self, ids, texts, metadatas):
+        with open(self.path, "a") as f:
+            for id, text, metadata in zip(ids, texts, metadatas):
+                f.write(json.dumps({"id": id, "text": text, "metadata": metadata}) + "\n")
+        self.ids += ids
+        self.texts += texts
+        self.metadatas += metadatas
+
+    def select(self, rows: list[int]):
+        # keeps only the given rows in memory, the file is written by save
+        self.ids = [self.ids[i] for i in rows]
+        self.texts = [self.texts[i] for i in rows]
+        self.metadatas = [self.metadatas[i] for i in rows]
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            for id, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                f.write(json.dumps({"id": id, "text": text, "metadata": metadata}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def keep(self, rows: list[int]):
+        self.select(rows)
+        self.save(self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    def document(self, row: int) -> Document:
+        return Document(self.texts[row], metadata=self.metadatas[row])
+
+
+class NumpyIndex(VectorIndex):
+    """
+    Flat index, exact search over a memory-mapped float32 matrix.
+    No server or startup cost, fast for small to medium memory sets.
+    Vectors and their squared norms are appended before the documents, so the documents file decides
+    which rows exist and rows left over by an interrupted add are cut off on load.
+    A delete writes all files anew and switches to them once they are complete.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.norms_path = os.path.join(directory, "norms.f32")
+        self.meta_path = os.path.join(directory, "index.json")
+        self.commit_path = os.path.join(directory, "delete.commit")
+        documents_path = os.path.join(directory, "documents.jsonl")
+        self.replaced = [self.vectors_path, self.norms_path, documents_path] # files rewritten by delete
+        self.lock = threading.RLock()
+        self._recover()
+        self.docs = DocumentStore(documents_path)
+        self.dim = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        self._load()
+
+    def _recover(self):
+        # finish a delete whose new files were all written, otherwise discard its partial files
+        for path in self.replaced:
+            if os.path.exists(path + ".tmp"):
+                if os.path.exists(self.commit_path): os.replace(path + ".tmp", path)
+                else: os.remove(path + ".tmp")
+        if os.path.exists(self.commit_path): os.remove(self.commit_path)
+
+    def _load(self):
+        rows = len(self.docs.ids)
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if rows and size and not self.dim:
+            self._save_meta(size // 4 // rows) # store written before the dimension was kept
+        # only rows with a document exist, vectors and norms behind them are cut off
+        for path, row_size in ((self.vectors_path, self.dim * 4), (self.norms_path, 4)):
+            if os.path.exists(path) and os.path.getsize(path) > rows * row_size:
+                with open(path, "r+b") as f: f.truncate(rows * row_size)
+        norms_size = os.path.getsize(self.norms_path) if os.path.exists(self.norms_path) else 0
+        if rows and self.dim and norms_size < rows * 4:
+            # store written before norms were kept, they are computed once
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self._write(self.norms_path, np.einsum("ij,ij->i", vectors, vectors).astype(np.float32).tobytes())
+            del vectors
+        self._map()
+
+    def _map(self):
+        rows = len(self.docs.ids)
+        if rows and self.dim:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            self.norms = np.memmap(self.norms_path, dtype=np.float32, mode="r", shape=(rows,))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.norms = np.zeros(0, dtype=np.float32)
+
+    def _unmap(self):
+        # released before the files are replaced
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+
+    def _save_meta(self, dim: int):
+        self.dim = dim
+        self._write(self.meta_path + ".tmp", json.dumps({"dim": dim}).encode())
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def _write(self, path: str, data: bytes, mode: str = "wb"):
+        with open(path, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, ids, texts, embeddings, metadatas):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        with self.lock:
+            if self.count() and matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match index dimension {self.dim}")
+            # replaced ids are removed first, so add works like an upsert
+            existing = set(ids) & set(self.docs.ids)
+            if existing: self.delete(list(existing))
+            if matrix.shape[1] != self.dim: self._save_meta(matrix.shape[1])
+            # norms are computed for the new rows only, documents are written last and make the rows visible
+            self._write(self.vectors_path, matrix.tobytes(), "ab")
+            self._write(self.norms_path, np.einsum("ij,ij->i", matrix, matrix).astype(np.float32).tobytes(), "ab")
+            self.docs.append(ids, texts, metadatas)
+            self._map()
+
+    def _scores(self, embedding) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = self.norms + float(query @ query) - 2 * (self.vectors @ query) # squared l2
+        return relevance_scores(distances)
+
+    def search(self, embedding, k, threshold=None):
+        with self.lock:
+            if k <= 0 or len(self.docs.ids) == 0: return []
+            scores = self._scores(embedding)
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.docs.document(int(i)), float(scores[i])) for i in top if threshold is None or scores[i] >= threshold]
+
+    def search_all(self, embedding, threshold, page_size=100):
+        with self.lock:
+            if len(self.docs.ids) == 0: return []
+            scores = self._scores(embedding)
+            matched = np.nonzero(scores >= threshold)[0]
+            matched = matched[np.argsort(-scores[matched])]
+            return [(self.docs.document(int(i)), float(scores[i])) for i in matched]
+
+    def mmr_search(self, embedding, k, fetch_k=20, lambda_mult=0.5):
+        with self.lock:
+            if len(self.docs.ids) == 0: return []
+            scores = self._scores(embedding)
+            candidates = np.argsort(-scores)[:fetch_k]
+            selected = maximal_marginal_relevance(np.asarray(embedding), np.asarray(self.vectors[candidates]), k, lambda_mult)
+            return [self.docs.document(int(candidates[i])) for i in selected]
+
+    def delete(self, ids):
+        with self.lock:
+            remove = set(ids)
+            keep = [i for i, id in enumerate(self.docs.ids) if id not in remove]
+            deleted = len(self.docs.ids) - len(keep)
+            if not deleted: return 0
+            vectors_path, norms_path, documents_path = self.replaced
+            self._write(vectors_path + ".tmp", np.array(self.vectors[keep]).tobytes())
+            self._write(norms_path + ".tmp", np.array(self.norms[keep]).tobytes())
+            self.docs.select(keep)
+            self.docs.save(documents_path + ".tmp")
+            self._write(self.commit_path, b"") # all new files are complete, from here on the delete is finished on load
+            self._unmap()
+            self._recover()
+            self._map()
+            return deleted
+
+    def count(self):
+        return len(self.docs.ids)
+
+    def close(self):
+        with self.lock:
+            self._unmap()
+
+    def entries(self):
+        with self.lock:
+            return [self.docs.document(i) for i in range(len(self.docs.ids))], np.array(self.vectors)
+
+
+class HnswIndex(VectorIndex):
+    """
+    Approximate nearest neighbour index using hnswlib, for larger memory sets.
+    Requires the optional hnswlib package.
+    """
+
+    def __init__(self, directory: str, ef: int = 64, m: int = 16):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("The hnsw memory backend requires the hnswlib package, install it with 'pip install hnswlib'.")
+        self.hnswlib = hnswlib
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.bin")
+        self.meta_path = os.path.join(directory, "index.json")
+        self.docs = DocumentStore(os.path.join(directory, "documents.jsonl"))
+        self.ef = ef
+        self.m = m
+        self.lock = threading.RLock()
+        self.index = None
+        self.labels: dict[str, int] = {} # document id -> hnsw label
+        self.next_label = 0
+        if os.path.exists(self.meta_path) and os.path.exists(self.index_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.index = hnswlib.Index(space="l2", dim=meta["dim"])
+            self.index.load_index(self.index_path, max_elements=meta["max_elements"], allow_replace_deleted=True)
+            self.index.set_ef(ef)
+            self.labels = meta["labels"]
+            self.next_label = meta["next_label"]
+        self._index_rows()
+
+    def _init_index(self, dim: int, capacity: int):
+        self.index = self.hnswlib.Index(space="l2", dim=dim)
+        self.index.init_index(max_elements=max(1024, capacity), ef_construction=200, M=self.m, allow_replace_deleted=True)
+        self.index.set_ef(self.ef)
+
+    def _save(self):
+        self.index.save_index(self.index_path) # type: ignore
+        with open(self.meta_path, "w") as f:
+            json.dump({"dim": self.index.dim, "max_elements": self.index.get_max_elements(), # type: ignore
+                       "labels": self.labels, "next_label": self.next_label}, f)
+
+    def add(self, ids, texts, embeddings, metadatas):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        with self.lock:
+            existing = set(ids) & set(self.labels)
+            if existing: self.delete(list(existing))
+            if self.index is None: self._init_index(matrix.shape[1], len(ids))
+            # slots of deleted items are reused, only live items count against the capacity
+            needed = len(self.labels) + len(ids)
+            if needed > self.index.get_max_elements(): # type: ignore
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements())) # type: ignore
+            labels = list(range(self.next_label, self.next_label + len(ids)))
+            self.next_label += len(ids)
+            self.index.add_items(matrix, labels, replace_deleted=True) # type: ignore
+            self.labels.update(zip(ids, labels))
+            self.rows.update((label, len(self.docs.ids) + i) for i, label in enumerate(labels))
+            self.docs.append(ids, texts, metadatas)
+            self._save()
+
+    def _index_rows(self):
+        # hnsw label -> row in the document store, rebuilt only when delete moves the rows
+        rows = {id: row for row, id in enumerate(self.docs.ids)}
+        self.rows: dict[int, int] = {label: rows[id] for id, label in self.labels.items() if id in rows}
+
+    def _knn(self, embedding, k):
+        count = self.count()
+        if self.index is None or count == 0 or k <= 0: return [], np.zeros(0)
+        labels, distances = self.index.knn_query(np.asarray(embedding, dtype=np.float32), k=min(k, count))
+        return [int(label) for label in labels[0]], distances[0]
+
+    def search(self, embedding, k, threshold=None):
+        with self.lock:
+            labels, distances = self._knn(embedding, k)
+            rows = self.rows
+            scores = relevance_scores(distances)
+            return [(self.docs.document(rows[label]), float(score)) for label, score in zip(labels, scores)
+                    if label in rows and (threshold is None or score >= threshold)]
+
+    def mmr_search(self, embedding, k, fetch_k=20, lambda_mult=0.5):
+        with self.lock:
+            labels, _ = self._knn(embedding, fetch_k)
+            if not labels: return []
+            vectors = np.array(self.index.get_items(labels)) # type: ignore
+            rows = self.rows
+            selected = maximal_marginal_relevance(np.asarray(embedding), vectors, k, lambda_mult)
+            return [self.docs.document(rows[labels[i]]) for i in selected if labels[i] in rows]
+
+    def delete(self, ids):
+        with self.lock:
+            remove = [id for id in ids if id in self.labels]
+            if not remove: return 0
+            for id in remove:
+                self.index.mark_deleted(self.labels.pop(id)) # type: ignore
+            removed = set(remove)
+            self.docs.keep([i for i, id in enumerate(self.docs.ids) if id not in removed])
+            self._index_rows()
+            self._save()
+            return len(remove)
+
+    def count(self):
+        return len(self.docs.ids)
+
+    def entries(self):
+        with self.lock:
+            if self.index is None or not self.docs.ids: return [], np.zeros((0, 0), dtype=np.float32)
+            labels = [self.labels[id] for id in self.docs.ids]
+            return [self.docs.document(i) for i in range(len(labels))], np.asarray(self.index.get_items(labels), dtype=np.float32)
+
+
+def create_index(backend: str, directory: str) -> VectorIndex:
+    if backend == NUMPY: return NumpyIndex(os.path.join(directory, "numpy"))
+    if backend == HNSW: return HnswIndex(os.path.join(directory, "hnsw"))
+    if backend == CHROMA: return ChromaIndex(directory)
+    raise ValueError(f"Unknown vector index backend '{backend}', use one of: {CHROMA}, {NUMPY}, {HNSW}")
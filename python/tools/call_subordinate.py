@@ -1,34 +1,88 @@
+import asyncio
 from agent import Agent
 from python.helpers.tool import Tool, Response
+from python.helpers import asyncio_utils, errors, files
+from python.helpers.agent_pool import pool
 
 class Delegation(Tool):
 
-    def execute(self, message="", agent_name="", reset="", **kwargs):
+    def execute(self, message="", agent_name="", reset="", messages=None, **kwargs):
+        if messages:
+            return asyncio_utils.run_sync(self.delegate_parallel(messages))
+
+        subordinate = self.get_subordinate(reset)
+        if not isinstance(subordinate, Agent): return subordinate
+
+        # Delegate the task to the subordinate
+        response = subordinate.message_loop(message)
+
+        return Response(message=response, break_loop=False)
+
+    async def aexecute(self, message="", agent_name="", reset="", messages=None, **kwargs):
+        if messages:
+            return await self.delegate_parallel(messages)
+
+        subordinate = self.get_subordinate(reset)
+        if not isinstance(subordinate, Agent): return subordinate
+
+        # Delegate the task to the subordinate on the same event loop
+        response = await subordinate.amessage_loop(message)
+
+        return Response(message=response, break_loop=False)
+
+    async def delegate_parallel(self, messages) -> Response:
+        # independent subtasks, one new subordinate each, at most subordinate_max_parallel running at once
+        if isinstance(messages, str): messages = [messages]
+        semaphore = asyncio.Semaphore(max(1, self.agent.config.subordinate_max_parallel))
+
+        async def delegate(message) -> str:
+            async with semaphore:
+                subordinate = self.create_subordinate()
+                if not isinstance(subordinate, Agent): return subordinate.message
+                try:
+                    return await subordinate.amessage_loop(str(message))
+                finally:
+                    pool.release(subordinate)
+
+        results = await asyncio.gather(*[delegate(message) for message in messages], return_exceptions=True)
+
+        # results in the order of the messages, a failed subtask reports its error in its place
+        response = "\n\n".join(
+            files.read_file("./prompts/fw.subordinate_result.md", number=i + 1,
+                            response=errors.format_error(result) if isinstance(result, Exception) else result)
+            for i, result in enumerate(results))
+        return Response(message=response, break_loop=False)
+
+    def get_subordinate(self, reset="") -> Agent | Response:
         # Check if we need to create a new subordinate or reset the existing one
         if self.agent.get_data("subordinate") is None or str(reset).lower().strip() == "true":
-            # Extract the current agent's number
-            current_number = self.agent.number  # Use the existing number directly
-            
-            # Determine the new subordinate's number
-            new_number = current_number + 1
-            
-            # Check if we've reached the delegation limit
-            max_delegation = 5  # You can adjust this number as needed
-            if new_number > max_delegation:
-                return Response(
-                    message="Maximum delegation depth reached. Cannot create more subordinates.",
-                    break_loop=True
-                )
-            
-            # Create the new subordinate agent with the correct number
-            subordinate = Agent(new_number, self.agent.config)
-            subordinate.set_data("superior", self.agent)
+            previous = self.agent.get_data("subordinate")
+            if previous:
+                self.agent.set_data("subordinate", None)
+                pool.release(previous) # the reset subordinate is reused for later tasks
+            subordinate = self.create_subordinate()
+            if not isinstance(subordinate, Agent): return subordinate
             self.agent.set_data("subordinate", subordinate)
-        
+
         # Get the existing subordinate
-        subordinate = self.agent.get_data("subordinate")
-        
-        # Delegate the task to the subordinate
-        response = subordinate.message_loop(message)
-        
-        return Response(message=response, break_loop=False)
+        return self.agent.get_data("subordinate")
+
+    def create_subordinate(self) -> Agent | Response:
+        # Extract the current agent's number
+        current_number = self.agent.number  # Use the existing number directly
+
+        # Determine the new subordinate's number
+        new_number = current_number + 1
+
+        # Check if we've reached the delegation limit
+        max_delegation = 5  # You can adjust this number as needed
+        if new_number > max_delegation:
+            return Response(
+                message="Maximum delegation depth reached. Cannot create more subordinates.",
+                break_loop=True
+            )
+
+        # Take a pooled subordinate agent with the correct number, or create a new one
+        subordinate = pool.acquire(new_number, self.agent.config)
+        subordinate.set_data("superior", self.agent)
+        return subordinate
@@ -1,13 +1,23 @@
 from dataclasses import dataclass
-import shlex
+import weakref
 from python.helpers import files
 from python.helpers.tool import Tool, Response
 from python.helpers.print_style import PrintStyle
 from python.helpers.docker import DockerContainerManager
+from python.helpers.docker_session import get_pool
+from python.helpers.exec_backend import ExecBackend, DockerBackend, ShellBackend, shell_command, DOCKER, LOCAL, SSH
+from python.helpers import docker_pool
 
 @dataclass
 class State:
-    docker: DockerContainerManager | None
+    backend: ExecBackend
+    finalizer: weakref.finalize # closes the backend once, from Agent.close or when the agent is garbage collected
+
+    def reset(self):
+        self.backend.reset()
+
+    def close(self):
+        self.finalizer()
 
 class CodeExecution(Tool):
     def execute(self, **kwargs):
@@ -43,17 +53,18 @@ class CodeExecution(Tool):
         runtime = self.args["runtime"].lower().strip()
         code = self.args["code"]
 
-        if runtime == "python":
-            command = f'python3 -c {shlex.quote(code)}'
-        elif runtime == "nodejs":
-            command = f'node -e {shlex.quote(code)}'
-        elif runtime == "terminal":
-            command = code
-        else:
+        if shell_command(runtime, code) is None:
             return Response(message=files.read_file("./prompts/fw.code_runtime_wrong.md", runtime=runtime), break_loop=False)
 
-        output = self.state.docker.execute_command(command)
-        
+        # output is printed live as it arrives, the call is bounded in time and in kept output
+        PrintStyle(font_color="#1B4F72", background_color="white", padding=True, bold=True).print(f"{self.agent.agent_name}: Code output:")
+        limits = dict(timeout=self.agent.config.code_exec_timeout_seconds,
+                      max_output_bytes=self.agent.config.code_exec_max_output_bytes,
+                      on_output=PrintStyle(font_color="#85C1E9").stream)
+
+        output = self.state.backend.run(runtime, code, **limits)
+        PrintStyle().print()
+
         if not output:
             output = files.read_file("./prompts/fw.code_no_output.md")
 
@@ -85,16 +96,54 @@ class CodeExecution(Tool):
         """
         self.state = self.agent.get_data("cot_state")
         if not self.state:
-            if self.agent.config.code_exec_docker_enabled:
-                docker = DockerContainerManager(
-                    name=self.agent.config.code_exec_docker_name,
-                    image=self.agent.config.code_exec_docker_image,
-                    ports=self.agent.config.code_exec_docker_ports,
-                    volumes=self.agent.config.code_exec_docker_volumes
-                )
-                docker.start_container()
-            else:
-                docker = None
-
-            self.state = State(docker=docker)
-        self.agent.set_data("cot_state", self.state)
\ No newline at end of file
+            backend = self.create_backend()
+            self.state = State(backend=backend, finalizer=weakref.finalize(self.agent, backend.close))
+        self.agent.set_data("cot_state", self.state)
+
+    def create_backend(self) -> ExecBackend:
+        config = self.agent.config
+        backend = config.code_exec_backend
+        if backend == DOCKER and not config.code_exec_docker_enabled:
+            # running code on the host instead has to be chosen explicitly, it is not sandboxed
+            raise ValueError(f"Code execution backend '{DOCKER}' requires code_exec_docker_enabled, set code_exec_backend to '{LOCAL}' to run code on this host without a sandbox")
+
+        if backend == LOCAL:
+            from python.helpers.shell_local import LocalInteractiveSession
+            return ShellBackend(LocalInteractiveSession())
+
+        if backend == SSH:
+            from python.helpers.shell_ssh import SSHInteractiveSession
+            if config.code_exec_docker_enabled: self.start_docker() # ssh server runs in the container
+            return ShellBackend(SSHInteractiveSession(config.code_exec_ssh_addr, config.code_exec_ssh_port, config.code_exec_ssh_user, config.code_exec_ssh_pass))
+
+        if backend != DOCKER:
+            raise ValueError(f"Unknown code execution backend '{backend}', use one of: {DOCKER}, {LOCAL}, {SSH}")
+
+        if config.code_exec_docker_pool_size > 0:
+            # own container leased from the pool, recycled when the backend is closed
+            containers = docker_pool.get_pool(
+                image=config.code_exec_docker_image,
+                name=config.code_exec_docker_name,
+                size=config.code_exec_docker_pool_size,
+                volumes=config.code_exec_docker_volumes,
+                ports=config.code_exec_docker_ports)
+            docker = containers.lease()
+            release = lambda: containers.release(docker)
+        else:
+            docker = self.start_docker()
+            release = None
+
+        pool = None
+        if config.code_exec_persistent_sessions:
+            pool = get_pool(docker, config.code_exec_session_pool_size, config.code_exec_session_preload)
+        return DockerBackend(docker, pool, release)
+
+    def start_docker(self) -> DockerContainerManager:
+        docker = DockerContainerManager(
+            name=self.agent.config.code_exec_docker_name,
+            image=self.agent.config.code_exec_docker_image,
+            ports=self.agent.config.code_exec_docker_ports,
+            volumes=self.agent.config.code_exec_docker_volumes
+        )
+        docker.start_container()
+        return docker
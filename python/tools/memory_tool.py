@@ -2,13 +2,19 @@ import re
 from agent import Agent
 from python.helpers.vector_db import VectorDB, Document
 from python.helpers import files
-import os, json
+import os, json, glob, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
 from python.helpers.tool import Tool, Response
 from python.helpers.print_style import PrintStyle
 from chromadb.errors import InvalidDimensionException
 
-# TODO multiple DBs at once
-db: VectorDB | None= None
+# open memory databases by memory_subdir (tenant), least recently used unused ones are closed above the limit
+dbs: OrderedDict[str, VectorDB] = OrderedDict()
+db_users: dict[str, int] = {} # memory_subdir -> calls currently using its database
+dbs_closing: dict[str, threading.Event] = {} # memory_subdir -> set once its evicted database is closed
+dbs_lock = threading.Lock()
 
 class Memory(Tool):
     def execute(self,**kwargs):
@@ -22,9 +28,16 @@ class Memory(Tool):
             elif "memorize" in kwargs:
                 result = save(self.agent, kwargs["memorize"])
             elif "forget" in kwargs:
-                result = forget(self.agent, kwargs["forget"])
+                threshold = float(kwargs.get("threshold", 0.1))
+                dry_run = str(kwargs.get("dry_run", "")).lower().strip() == "true"
+                result = forget(self.agent, kwargs["forget"], threshold, dry_run)
             elif "delete" in kwargs:
                 result = delete(self.agent, kwargs["delete"])
+            elif "ingest" in kwargs:
+                result = ingest(self.agent, kwargs["ingest"], kwargs.get("pattern", "**/*"))
+            elif "compact" in kwargs:
+                dry_run = str(kwargs.get("dry_run", "")).lower().strip() == "true"
+                result = compact(self.agent, float(kwargs.get("threshold", self.agent.config.memory_compact_threshold)), dry_run)
         except InvalidDimensionException as e:
             # hint about embedding change with existing database
             PrintStyle.hint("If you changed your embedding model, you will need to remove contents of /memory directory.")
@@ -34,32 +47,121 @@ class Memory(Tool):
         return Response(message=result, break_loop=False)
             
 def search(agent:Agent, query:str, count:int=5, threshold:float=0.1):
-    initialize(agent)
-    docs = db.search_similarity_threshold(query,count,threshold) # type: ignore
+    with use_db(agent) as db:
+        docs = db.search_similarity_threshold(query,count,threshold)
     if len(docs)==0: return files.read_file("./prompts/fw.memories_not_found.md", query=query)
     else: return str(docs)
 
+def search_with_scores(agent:Agent, query:str, count:int=5, threshold:float=0.1) -> list[tuple[Document, float]]:
+    with use_db(agent) as db:
+        return db.search_similarity_threshold_with_scores(query,count,threshold)
+
 def save(agent:Agent, text:str):
-    initialize(agent)
-    id = db.insert_document(text) # type: ignore
+    with use_db(agent) as db:
+        id = db.insert_document(text, dedupe_threshold=agent.config.memory_dedupe_threshold)
     return files.read_file("./prompts/fw.memory_saved.md", memory_id=id)
 
 def delete(agent:Agent, ids_str:str):
-    initialize(agent)
     ids = extract_guids(ids_str)
-    deleted = db.delete_documents_by_ids(ids) # type: ignore
+    with use_db(agent) as db:
+        deleted = db.delete_documents_by_ids(ids)
     return files.read_file("./prompts/fw.memories_deleted.md", memory_count=deleted)    
 
-def forget(agent:Agent, query:str):
-    initialize(agent)
-    deleted = db.delete_documents_by_query(query) # type: ignore
+def forget(agent:Agent, query:str, threshold:float=0.1, dry_run:bool=False):
+    with use_db(agent) as db:
+        deleted = db.delete_documents_by_query(query, threshold, dry_run)
+    if dry_run: return files.read_file("./prompts/fw.memories_to_delete.md", memory_count=deleted)
     return files.read_file("./prompts/fw.memories_deleted.md", memory_count=deleted)
 
-def initialize(agent:Agent):
-    global db
-    if not db:
-        dir = os.path.join("memory",agent.config.memory_subdir)
-        db = VectorDB(embeddings_model=agent.config.embeddings_model, in_memory=False, cache_dir=dir)
+def ingest(agent:Agent, directory:str, pattern:str="**/*"):
+    # bulk memorize all text files in a directory, larger files are split into chunks
+    path = resolve_work_path(directory)
+    if not path: return files.read_file("./prompts/fw.memories_ingest_outside.md", directory=directory)
+    with use_db(agent) as db:
+        stats = db.ingest(
+            read_chunks(path, pattern, agent.config.memory_ingest_chunk_size),
+            batch_size=agent.config.memory_ingest_batch_size,
+            workers=agent.config.memory_ingest_workers,
+            dedupe_threshold=agent.config.memory_dedupe_threshold)
+    return files.read_file("./prompts/fw.memories_ingested.md", directory=directory, **stats)
+
+def compact(agent:Agent, threshold:float=0.9, dry_run:bool=False):
+    # offline consolidation of near duplicate memories
+    with use_db(agent) as db:
+        stats = db.compact(threshold, dry_run)
+    PrintStyle(font_color="cyan").print(f"Memory compaction{' (dry run)' if dry_run else ''}: {stats}")
+    return files.read_file("./prompts/fw.memories_compacted.md", **stats)
+
+def resolve_work_path(path:str) -> str | None:
+    # the agent sees work_dir as /root in its container, files outside work_dir are not readable from the sandbox and are rejected
+    work_dir = os.path.realpath(files.get_abs_path("work_dir"))
+    path = path.strip()
+    if path == "/root" or path.startswith("/root/"): path = path[len("/root"):].lstrip("/")
+    elif os.path.isabs(path): return None
+    resolved = os.path.realpath(os.path.join(work_dir, path))
+    return resolved if is_in_work_dir(resolved) else None
+
+def is_in_work_dir(path:str) -> bool:
+    work_dir = os.path.realpath(files.get_abs_path("work_dir"))
+    return os.path.commonpath([work_dir, os.path.realpath(path)]) == work_dir
+
+def read_chunks(directory:str, pattern:str="**/*", chunk_size:int=2000):
+    for path in sorted(glob.glob(os.path.join(directory, pattern), recursive=True)):
+        if not os.path.isfile(path) or not is_in_work_dir(path): continue # pattern or symlinks leading out of work_dir
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except UnicodeDecodeError:
+            continue # skip binary files
+
+        # split at paragraph boundaries, keep the source file name as the agent sees it with every chunk
+        name = "/root/" + os.path.relpath(os.path.realpath(path), os.path.realpath(files.get_abs_path("work_dir")))
+        chunk = ""
+        for paragraph in text.split("\n\n"):
+            if chunk and len(chunk) + len(paragraph) > chunk_size:
+                yield f"{name}:\n{chunk.strip()}"
+                chunk = ""
+            chunk += paragraph + "\n\n"
+        if chunk.strip():
+            yield f"{name}:\n{chunk.strip()}"
+
+@contextmanager
+def use_db(agent:Agent) -> Iterator[VectorDB]:
+    # the memory database of the agent's memory_subdir, it is not closed while in use
+    subdir = agent.config.memory_subdir
+    while True:
+        with dbs_lock:
+            closing = dbs_closing.get(subdir)
+            if not closing:
+                if subdir in dbs:
+                    dbs.move_to_end(subdir)
+                else:
+                    dir = os.path.join("memory",subdir)
+                    dbs[subdir] = VectorDB(embeddings_model=agent.config.embeddings_model, in_memory=False, cache_dir=dir, backend=agent.config.memory_backend)
+                db = dbs[subdir]
+                db_users[subdir] = db_users.get(subdir, 0) + 1
+                break
+        closing.wait() # chroma shares one client per path, it is opened again only after the old one has stopped
+    try:
+        yield db
+    finally:
+        with dbs_lock:
+            db_users[subdir] -= 1
+            if not db_users[subdir]: del db_users[subdir]
+            idle = evict_idle(max(1, agent.config.memory_max_open_dbs))
+        for name, closed in idle: # outside the lock, other tenants are not blocked while a store shuts down
+            try:
+                closed.close()
+            finally:
+                with dbs_lock:
+                    dbs_closing.pop(name).set()
+
+def evict_idle(limit:int) -> list[tuple[str, VectorDB]]:
+    # called with dbs_lock held, least recently used databases nobody is using, beyond the limit
+    # databases in use stay open even above the limit and are evicted once released
+    idle = [subdir for subdir in dbs if subdir not in db_users][:max(0, len(dbs) - limit)]
+    for subdir in idle: dbs_closing[subdir] = threading.Event()
+    return [(subdir, dbs.pop(subdir)) for subdir in idle]
 
 def extract_guids(text):
     pattern = r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[1-5][0-9a-fA-F]{3}-[89abAB][0-9a-fA-F]{3}-[0-9a-fA-F]{12}\b'